@@ -5,67 +5,216 @@ this file is full of helper functions and general things
 """
 import socket
 import logging
-from time import sleep, time
-from lights.lightstrip import LightStrip
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time, perf_counter
+import metrics
 from lights.light import Light
+from registry import LightRegistry, ADDED, MOVED
 NUM_PORTS = 65536
 ELGATO_PORT = 9123
+# how long to wait on a single host before giving up on it
+PROBE_TIMEOUT = 2
+# how many hosts are probed at the same time during discovery
+DISCOVERY_WORKERS = 32
+
+
+def probe_light(addr, port, name="", timeout=PROBE_TIMEOUT):
+    """
+    Try to create a light at addr:port.
+
+    Returns the light or None if nothing usable answered within timeout
+    """
+    log = logging.getLogger(__name__)
+    try:
+        return Light.detect_type(addr, port, name, timeout=timeout)
+    except Exception as e:
+        log.warning(f"Failed to add light {addr}:{port}")
+        log.warning(f"Caught exception: {e}")
+        return None
+
+
+def add_light(lights: dict, light, lock=None):
+    """Add a light to a dictionary of lights split by productName."""
+    logging.info(f"\tadding {light.info['productName']}: {light.info['displayName']}")
+    if lock is None:
+        lights.setdefault(light.info['productName'], []).append(light)
+        return
+    with lock:
+        lights.setdefault(light.info['productName'], []).append(light)
 
 class ServiceListener:
     """Listener for Zeroconf."""
 
-    def __init__(self):
-        """Init the listener."""
+    def __init__(self, probe_timeout=PROBE_TIMEOUT, max_workers=DISCOVERY_WORKERS):
+        """
+        Init the listener.
+
+        Lights are probed on a bounded pool of workers so the zeroconf
+        callback thread is never blocked on a slow or dead host.
+        Found lights live in a LightRegistry keyed by serial number,
+        re-announced services and IP changes reuse the existing Light
+        """
         self.services = []
-        # useful if we want to leave the listener running by having future lists of lights just reference this one
-        # so when this list is updated, the others should be updated as well
+        self.registry = LightRegistry()
+        # live view of the registry split by productName, kept for rolling admission users
         self.lights = dict()
+        self.probe_timeout = probe_timeout
+        # called with each light as it is admitted, moved or removed
+        self.on_add = []
+        self.on_update = []
+        self.on_remove = []
+        # service name -> light that was found through it
+        self._service_lights = dict()
+        # guards services, notified whenever something new shows up
+        self._lock = threading.Condition()
+        self._last_activity = time()
+        self._pending = 0
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='elgato-discovery')
 
     def get_services(self):
         """Return the services."""
-        return self.services
+        with self._lock:
+            return list(self.services)
+
     def get_lights(self) -> dict:
         """
         Return the lights that are in the network
         Lights are stored in a dictionary that splits them by type
+        Use registry.snapshot() for a consistent view during a rolling admission
         """
         return self.lights
 
     def remove_service(self, zeroconf, type, name):
-        """Remove a service."""
-        info = zeroconf.get_service_info(type, name)
-        self.services.remove(info)
+        """Remove a service and the light that was found through it."""
+        with self._lock:
+            self.services = [info for info in self.services if info.name != name]
+            light = self._service_lights.pop(name, None)
+        if light is not None and self.registry.remove(light):
+            logging.info(f"\tremoving {light.info['productName']}: {light.info['displayName']}")
+            with self._lock:
+                group = self.lights.get(light.info['productName'], [])
+                if light in group:
+                    group.remove(light)
+            self._notify(self.on_remove, light)
+
+    def _notify(self, callbacks, light):
+        """Call every callback with the light, a failing callback does not stop the others."""
+        log = logging.getLogger(__name__)
+        for callback in list(callbacks):
+            try:
+                callback(light)
+            except Exception as e:
+                log.warning(f"Listener callback {callback} failed: {e}")
 
     def update_service(self, zeroconf, type, name):
         """
         Update a service.
-        
-        I don't think this one will get called
+
+        Handled like an announcement, a known light is only moved if its address changed
         """
-        log = logging.getLogger(__name__)
-        log.warning("update service was called but is not handled")
+        self.add_service(zeroconf, type, name)
 
     def add_service(self, zeroconf, type, name):
         """Called when a new thing is found"""
+        with self._lock:
+            self._pending += 1
+            self._last_activity = time()
+        self._pool.submit(self._add_service, zeroconf, type, name)
+
+    def _add_service(self, zeroconf, type, name):
+        """Resolve the service and admit, move or ignore its light."""
         log = logging.getLogger(__name__)
-        info = zeroconf.get_service_info(type, name)
-        self.services.append(info)
-        # add the light
-        for addr in info.addresses:
-            try:
-                prospect_light = Light.detect_type(socket.inet_ntoa(addr), info.port, info.get_name())
-                if prospect_light.info['productName'] not in self.lights:
-                    self.lights[prospect_light.info['productName']] = []
-                logging.info(f"\tadding {prospect_light.info['productName']}: {prospect_light.info['displayName']}")
-                self.lights[prospect_light.info['productName']].append(prospect_light)
-            except Exception as e:
-                log.warning("Failed to connect to light")
-                log.warning(f"Caught exception:\n{e}")
-                
+        try:
+            info = zeroconf.get_service_info(type, name)
+            if info is None:
+                log.warning(f"Could not resolve service: {name}")
+                return
+            addresses = [(socket.inet_ntoa(addr), info.port) for addr in info.addresses]
+            with self._lock:
+                self.services = [known for known in self.services if known.name != name]
+                self.services.append(info)
+                known = self._service_lights.get(name)
+            if known is not None:
+                # re-announced, no need to probe a light we already have
+                if addresses and (known.addr, known.port) not in addresses:
+                    log.info(f"{known.full_addr} moved to {addresses[0][0]}:{addresses[0][1]}")
+                    if self.registry.move(known, *addresses[0]):
+                        self._notify(self.on_update, known)
+                return
+            # every address belongs to the same light, the first one that answers is enough
+            for addr, port in addresses:
+                prospect_light = probe_light(addr, port, info.get_name(), self.probe_timeout)
+                if not prospect_light:
+                    continue
+                light, status = self.registry.admit(prospect_light)
+                with self._lock:
+                    self._service_lights[name] = light
+                if status == ADDED:
+                    add_light(self.lights, light, self._lock)
+                    self._notify(self.on_add, light)
+                elif status == MOVED:
+                    self._notify(self.on_update, light)
+                break
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._last_activity = time()
+                self._lock.notify_all()
+
+    def _found_expected(self, expected_count, expected_serials) -> bool:
+        """Check if the lights found so far cover what the caller expects."""
+        if expected_count is None and not expected_serials:
+            return False
+        found = self.registry.snapshot().lights
+        if expected_count is not None and len(found) < expected_count:
+            return False
+        if expected_serials:
+            serials = {light.info.get('serialNumber') for light in found}
+            if not set(expected_serials) <= serials:
+                return False
+        return True
 
+    def wait_for(self,
+                 timeout,
+                 expected_count: int = None,
+                 expected_serials: list = None,
+                 quiet_period: float = None) -> bool:
+        """
+        Block until discovery can stop early or timeout seconds have passed.
+
+        Discovery stops early once expected_count lights (and/or every serial
+        number in expected_serials) have been found, or once nothing new has
+        been announced for quiet_period seconds and no probe is in flight.
+        Returns True if it stopped early
+        """
+        deadline = time() + timeout
+        with self._lock:
+            while True:
+                now = time()
+                if self._found_expected(expected_count, expected_serials):
+                    return True
+                wait = deadline - now
+                if quiet_period is not None and not self._pending:
+                    quiet_left = self._last_activity + quiet_period - now
+                    if quiet_left <= 0:
+                        return True
+                    wait = min(wait, quiet_left)
+                if wait <= 0:
+                    return False
+                self._lock.wait(wait)
 
+    def close(self, wait=True):
+        """Stop probing, by default waits for probes that already started."""
+        self._pool.shutdown(wait=wait)
 
-def find_light_strips_zeroconf(service_type='_elg._tcp.local.', TIMEOUT=15) -> dict:
+
+def find_light_strips_zeroconf(service_type='_elg._tcp.local.',
+                               TIMEOUT=15,
+                               expected_count: int = None,
+                               expected_serials: list = None,
+                               quiet_period: float = None) -> dict:
         """
         Use multicast to find all elgato light strips.
         Returns a dictionary where lights are separated by productName
@@ -73,6 +222,11 @@ def find_light_strips_zeroconf(service_type='_elg._tcp.local.', TIMEOUT=15) -> d
         Parameters:
             the service type to search
             the timeout period to wait until you stop searching
+            the number of lights to stop searching after
+            the serial numbers to stop searching after they have all been found
+            how long without a new announcement before you stop searching
+
+        TIMEOUT is only an upper bound when any of the early exit conditions are given
 
         NOTE: this is not a rolling admission
         """
@@ -88,18 +242,29 @@ def find_light_strips_zeroconf(service_type='_elg._tcp.local.', TIMEOUT=15) -> d
 
         lightstrips = dict()
 
+        started = perf_counter()
         zc = zeroconf.Zeroconf()
         listener = ServiceListener()
         browser = zeroconf.ServiceBrowser(zc, service_type, listener)
-        sleep(TIMEOUT)
+        stopped_early = listener.wait_for(
+            TIMEOUT, expected_count, expected_serials, quiet_period)
         browser.cancel()
+        # nothing left worth waiting for if we already have what we wanted
+        listener.close(wait=not stopped_early)
+        zc.close()
+        if metrics.ENABLED:
+            metrics.observe('elgato_discovery_seconds', perf_counter() - started, method='zeroconf')
+            metrics.inc('elgato_discovered_lights_total', len(listener.registry), method='zeroconf')
         return listener.get_lights()
 
 def start_rolling_admission_zeroconf(
-        service_type='_elg._tcp.local.') -> tuple:
+        service_type='_elg._tcp.local.',
+        listener: ServiceListener = None) -> tuple:
     """
     Start a rolling admission for Zeroconf.
     Returns the dictionary of lights and the ServiceBrowser (which will need to be canceled later)
+
+    Pass in a listener to get its on_add/on_remove callbacks as lights come and go
     """
     log = logging.getLogger(__name__)
     try:
@@ -110,26 +275,67 @@ def start_rolling_admission_zeroconf(
         return (dict(), None)
 
     zc = zeroconf.Zeroconf()
-    listener = ServiceListener()
+    if listener is None:
+        listener = ServiceListener()
     browser = zeroconf.ServiceBrowser(zc, service_type, listener)
     return (listener.get_lights(), browser)
 
+
+def resolve_service_zeroconf(name,
+                             service_type='_elg._tcp.local.',
+                             timeout=PROBE_TIMEOUT) -> list:
+    """
+    Ask for a single light by its service name instead of browsing for all of them.
+
+    name is the service instance name (what Light.name is set to by zeroconf discovery)
+    Returns the (addr, port) pairs it answered with, empty if it did not answer within timeout
+    """
+    log = logging.getLogger(__name__)
+    try:
+        import zeroconf
+    except Exception:
+        log.warning("please install zeroconf to use this method")
+        log.warning("$ pip install zeroconf")
+        return []
+
+    zc = zeroconf.Zeroconf()
+    try:
+        info = zc.get_service_info(
+            service_type, f"{name}.{service_type}", timeout=int(timeout * 1000))
+    finally:
+        zc.close()
+    if info is None:
+        return []
+    return [(socket.inet_ntoa(addr), info.port) for addr in info.addresses]
+
     
 
-def find_light_strips_manual(strips) -> dict:
+def find_light_strips_manual(strips,
+                             timeout=PROBE_TIMEOUT,
+                             max_workers=DISCOVERY_WORKERS,
+                             lights: dict = None) -> dict:
     """
     Given a list of addr, port combinations, creates a dictionary of lights from them
+
+    Addresses are probed in parallel and each probe gives up after timeout seconds,
+    so a sweep costs roughly len(strips) / max_workers timeouts instead of len(strips).
+    Pass in lights to have it filled in as each light answers.
     """
-    log = logging.getLogger(__name__)
-    lights = {}
-    for (addr, port) in strips:
-        try:
-            prospect_light = Light.detect_type(addr, port)
-            if prospect_light.info['productName'] not in lights:
-                    lights[prospect_light.info['productName']] = []
-            logging.info(f"\tadding {prospect_light.info['productName']}: {prospect_light.info['displayName']}")
-            lights[prospect_light.info['productName']].append(prospect_light)
-        except Exception as e:
-            log.warning(f"Failed to add light {addr}:{port}")
-            log.warning(f"Caught exception: {e}")
-    return lights
\ No newline at end of file
+    if lights is None:
+        lights = {}
+    lock = threading.Lock()
+    started = perf_counter()
+    found = 0
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='elgato-discovery') as pool:
+        probes = [pool.submit(probe_light, addr, port, "", timeout)
+                  for (addr, port) in strips]
+        for probe in as_completed(probes):
+            prospect_light = probe.result()
+            if prospect_light:
+                add_light(lights, prospect_light, lock)
+                found += 1
+    if metrics.ENABLED:
+        metrics.observe('elgato_discovery_seconds', perf_counter() - started, method='manual')
+        metrics.inc('elgato_discovered_lights_total', found, method='manual')
+    return lights
@@ -0,0 +1,156 @@
+"""
+Compile host side animations into device side scenes
+
+A light strip loops its scene on its own: each element holds a color for
+durationMs and then fades into the next one over transitionMs. Any
+animation that can be approximated by straight fades between keyframes
+can therefore be sent once as a Scene instead of streamed frame by frame.
+
+compile_animation samples the animation, then keeps splitting the loop
+at the sample that is furthest from the fade the light would show until
+every sample is within tolerance (or max_elements is reached). Keyframes
+that repeat the same color become holds (durationMs) instead of fades.
+
+    scene = compile_animation(lambda t: ((t * 36) % 360, 100.0, 50.0), duration_ms=10000)
+    upload_animation(light, scene)
+
+Colors are (hue, saturation, brightness) with hue in degrees, fades take
+the short way around the hue circle like scenegen.interpolate.
+"""
+import heapq
+from scene import Scene
+from payload import scene_payload
+
+# default spacing between samples of a callable animation
+SAMPLE_MS = 50
+# default largest allowed difference, in degrees of hue or points of saturation/brightness
+TOLERANCE = 2.0
+
+
+def hue_distance(a: float, b: float) -> float:
+    """Distance between two hues going the short way around the circle."""
+    return abs((b - a + 180) % 360 - 180)
+
+
+def color_error(a, b) -> float:
+    """Largest difference between two (hue, saturation, brightness) colors on any channel."""
+    return max(hue_distance(a[0], b[0]), abs(a[1] - b[1]), abs(a[2] - b[2]))
+
+
+def fade(a, b, t: float) -> tuple:
+    """Color t (0-1) of the way through a fade from a to b."""
+    hue = (a[0] + ((b[0] - a[0] + 180) % 360 - 180) * t) % 360
+    return (hue, a[1] + (b[1] - a[1]) * t, a[2] + (b[2] - a[2]) * t)
+
+
+def sample(animation, duration_ms: int, sample_ms: int = SAMPLE_MS) -> list:
+    """
+    Sample a callable animation(t) -> (hue, saturation, brightness), t in seconds.
+
+    Returns the colors every sample_ms over one loop of duration_ms
+    """
+    return [tuple(animation(t_ms / 1000)) for t_ms in range(0, int(duration_ms), int(sample_ms))]
+
+
+def _worst(colors: list, start: int, end: int) -> tuple:
+    """Return (error, index) of the sample furthest from the fade between start and end."""
+    count = len(colors)
+    a = colors[start % count]
+    b = colors[end % count]
+    worst = (0.0, None)
+    for index in range(start + 1, end):
+        error = color_error(colors[index], fade(a, b, (index - start) / (end - start)))
+        if error > worst[0]:
+            worst = (error, index)
+    return worst
+
+
+def fit(colors: list, tolerance: float = TOLERANCE, max_elements: int = None) -> list:
+    """
+    Pick the fewest keyframes whose fades stay within tolerance of colors.
+
+    colors are evenly spaced samples of one loop, the last one fades back
+    into the first. The segment with the largest error is split first, so
+    when max_elements stops the fit early the error left is as small as it can be.
+    Returns the sorted sample indexes of the keyframes
+    """
+    count = len(colors)
+    if count <= 1:
+        return list(range(count))
+    limit = max_elements if max_elements is not None else count
+    keyframes = [0]
+    # the loop is one segment from the first sample around to itself
+    heap = []
+    error, index = _worst(colors, 0, count)
+    if index is not None:
+        heapq.heappush(heap, (-error, 0, count, index))
+    while heap and len(keyframes) < limit:
+        error, start, end, index = heapq.heappop(heap)
+        if -error <= tolerance:
+            break
+        keyframes.append(index)
+        for segment in ((start, index), (index, end)):
+            error, worst = _worst(colors, *segment)
+            if worst is not None:
+                heapq.heappush(heap, (-error, segment[0], segment[1], worst))
+    return sorted(keyframes)
+
+
+def compile_animation(animation,
+                      duration_ms: int = None,
+                      sample_ms: int = SAMPLE_MS,
+                      tolerance: float = TOLERANCE,
+                      max_elements: int = None) -> Scene:
+    """
+    Turn an animation into a looping Scene with as few elements as possible.
+
+    animation is a callable animation(t) -> (hue, saturation, brightness)
+    sampled over duration_ms, or a list of colors already sampled every sample_ms.
+    Every sample is within tolerance of what the light shows unless
+    max_elements (the number of scene elements the light supports) runs out first
+    """
+    if callable(animation):
+        if duration_ms is None:
+            raise ValueError("a callable animation needs a duration_ms")
+        colors = sample(animation, duration_ms, sample_ms)
+    else:
+        colors = [tuple(color) for color in animation]
+    if not colors:
+        raise ValueError("cannot compile an empty animation")
+    keyframes = fit(colors, tolerance, max_elements)
+    scene = Scene()
+    count = len(colors)
+    ends = keyframes[1:] + [count]
+    position = 0
+    while position < len(keyframes):
+        start = keyframes[position]
+        # a fade between equal colors is a hold, fold it into the next element
+        hold = start
+        while position + 1 < len(keyframes) and colors[keyframes[position + 1]] == colors[start]:
+            position += 1
+            hold = keyframes[position]
+        end = ends[position]
+        hue, saturation, brightness = colors[start]
+        scene.add_scene(hue, saturation, brightness,
+                        int(round((hold - start) * sample_ms)),
+                        int(round((end - hold) * sample_ms)))
+        position += 1
+    return scene
+
+
+def upload_animation(light, animation,
+                     scene_name='animation',
+                     scene_id='animation-id',
+                     brightness: float = 100.0,
+                     **options) -> bool:
+    """
+    Compile an animation (or take a compiled Scene) and send it to a light strip in one PUT.
+
+    options are passed to compile_animation
+    Returns True if the light accepted it
+    """
+    scene = animation if isinstance(animation, Scene) else compile_animation(animation, **options)
+    light.make_scene(scene_name, scene_id, brightness)
+    light.update_scene_data(scene, scene_name=scene_name, scene_id=scene_id, brightness=brightness)
+    return light.set_strip_data(
+        payload=scene_payload(light.type, scene, scene_name, scene_id, brightness))
@@ -0,0 +1,151 @@
+"""
+Benchmarks for the hot paths of the library
+
+Runs against a FakeFleet on localhost, so the numbers measure the
+library (and the network stack) rather than real lights.
+
+    $ python benchmark.py --lights 100 --latency 0.005 --json
+"""
+import argparse
+import json
+import random
+import threading
+from time import monotonic, perf_counter
+from _core import find_light_strips_manual
+from connection import get_executor
+from fakelight import FakeFleet
+from room import Room
+from scheduler import Scheduler
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Return the value below which fraction of the samples fall."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+def summarize(samples: list) -> dict:
+    """Summarize latencies in seconds as milliseconds."""
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples, default=0.0) * 1000,
+    }
+
+
+def bench_discovery(fleet: FakeFleet) -> tuple:
+    """Time a manual sweep over every light in the fleet."""
+    start = perf_counter()
+    found = find_light_strips_manual(fleet.addresses())
+    elapsed = perf_counter() - start
+    lights = [light for group in found.values() for light in group]
+    return lights, {'lights': len(lights), 'seconds': elapsed}
+
+
+def bench_room_color(room: Room, rounds: int) -> dict:
+    """Time room wide color changes, every round changes the color so nothing is skipped."""
+    samples = []
+    failures = 0
+    for round_number in range(rounds):
+        start = perf_counter()
+        if not room.room_color(1, round_number % 360, 100, 50):
+            failures += 1
+        samples.append(perf_counter() - start)
+    result = summarize(samples)
+    result['failures'] = failures
+    return result
+
+
+def bench_scheduler(calls: int, window: float) -> dict:
+    """Measure how late the scheduler fires calls spread over window seconds."""
+    scheduler = Scheduler()
+    lateness = []
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def fire(deadline):
+        late = monotonic() - deadline
+        with lock:
+            lateness.append(late)
+            if len(lateness) == calls:
+                finished.set()
+
+    start = monotonic()
+    for _ in range(calls):
+        deadline = start + random.uniform(0, window)
+        scheduler.call_at(deadline, fire, deadline)
+    finished.wait(window + 10)
+    return summarize(lateness)
+
+
+def bench_requests(lights: list, seconds: float) -> dict:
+    """Measure GET /elgato/lights throughput, one at a time and across the whole fleet."""
+    count = 0
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        lights[count % len(lights)].get_strip_data()
+        count += 1
+    sequential = count / seconds
+
+    executor = get_executor()
+    count = 0
+    start = perf_counter()
+    end = start + seconds
+    while perf_counter() < end:
+        futures = [executor.submit(light.get_strip_data) for light in lights]
+        for future in futures:
+            future.result()
+        count += len(futures)
+    concurrent = count / (perf_counter() - start)
+    return {'sequential_per_s': sequential, 'concurrent_per_s': concurrent}
+
+
+def run(lights=50, latency=0.0, jitter=0.0, failure_rate=0.0,
+        rounds=20, scheduled_calls=1000, window=1.0, seconds=2.0) -> dict:
+    """Run every benchmark against a fresh fleet and return the results."""
+    with FakeFleet(lights, latency=latency, jitter=jitter, failure_rate=failure_rate) as fleet:
+        found, discovery = bench_discovery(fleet)
+        results = {
+            'discovery': discovery,
+            'room_color': bench_room_color(Room(found), rounds),
+            'scheduler': bench_scheduler(scheduled_calls, window),
+            'requests': bench_requests(found, seconds) if found else {},
+            'fleet_requests': fleet.requests(),
+        }
+    return results
+
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lights', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rounds', type=int, default=20, help='room_color rounds')
+    parser.add_argument('--scheduled-calls', type=int, default=1000)
+    parser.add_argument('--window', type=float, default=1.0, help='seconds to spread scheduled calls over')
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of the throughput test')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+    results = run(args.lights, args.latency, args.jitter, args.failure_rate,
+                  args.rounds, args.scheduled_calls, args.window, args.seconds)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        if isinstance(result, dict):
+            print(name)
+            for key, value in result.items():
+                print(f"    {key:18} {value:.3f}" if isinstance(value, float) else f"    {key:18} {value}")
+        else:
+            print(f"{name} {result}")
+
+
+if __name__ == '__main__':
+    main()
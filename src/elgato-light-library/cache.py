@@ -0,0 +1,128 @@
+"""
+On-disk cache of discovered lights
+
+Lights are stored by serial number along with the address, port and the
+last known accessory info and settings, so a Room can be rebuilt without
+running discovery or asking every light what it is.
+Cached lights are revalidated with a single accessory-info request each.
+"""
+import json
+import logging
+import os
+import tempfile
+from time import time
+from connection import get_executor
+from lights.light import Light
+from policy import get_policy
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'elgato-light-library', 'lights.json')
+CACHE_VERSION = 1
+# how long revalidation waits on a cached address before calling it stale
+REVALIDATE_TIMEOUT = 2
+
+
+def load_cache(path=DEFAULT_CACHE_PATH) -> dict:
+    """
+    Read the cache file.
+
+    Returns a dictionary of entries keyed by serial number,
+    a missing or unreadable cache is treated as empty
+    """
+    log = logging.getLogger(__name__)
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log.warning(f"Ignoring unreadable light cache {path}: {e}")
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        log.info(f"Ignoring light cache {path} with version {cache.get('version')}")
+        return {}
+    return cache.get('lights', {})
+
+
+def save_cache(lights: list, path=DEFAULT_CACHE_PATH):
+    """
+    Write the lights to the cache file.
+
+    The file is replaced atomically so a crash never leaves half a cache behind
+    """
+    entries = {}
+    for light in lights:
+        serial = light.info.get('serialNumber')
+        if not serial:
+            continue
+        entries[serial] = {
+            'addr': light.addr,
+            'port': light.port,
+            'name': light.name,
+            'productName': light.info['productName'],
+            'info': light.info,
+            # only store settings if they were loaded, never fetch them just for the cache
+            'settings': light._settings,
+            'last_seen': time(),
+        }
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'lights': entries}, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def lights_from_cache(cache: dict) -> list:
+    """Create lights from cache entries without sending any requests."""
+    log = logging.getLogger(__name__)
+    lights = []
+    for serial, entry in cache.items():
+        try:
+            light = Light.from_info(
+                entry['addr'], entry['port'], entry['info'], name=entry.get('name', ""))
+        except Exception as e:
+            log.warning(f"Skipping bad cache entry for {serial}: {e}")
+            continue
+        if entry.get('settings') is not None:
+            light.settings = entry['settings']
+        lights.append(light)
+    return lights
+
+
+def revalidate_light(light, timeout=REVALIDATE_TIMEOUT) -> bool:
+    """
+    Check that a cached light is still at its cached address.
+
+    Costs one accessory-info request, sent once and without touching the
+    light's breaker or info. Returns False if nothing answered or a
+    different light answered
+    """
+    serial = light.info.get('serialNumber')
+    policy = light.policy or get_policy()
+    try:
+        info = policy.request(
+            'GET', 'http://' + light.full_addr + '/elgato/accessory-info',
+            timeout=timeout, retry=False, verify=False).json()
+    except Exception:
+        return False
+    return info.get('serialNumber') == serial
+
+
+def revalidate_lights(lights: list, timeout=REVALIDATE_TIMEOUT) -> tuple:
+    """
+    Revalidate every light in parallel.
+
+    Returns (valid lights, stale lights)
+    """
+    executor = get_executor()
+    checks = [(light, executor.submit(revalidate_light, light, timeout))
+              for light in lights]
+    valid, stale = [], []
+    for light, check in checks:
+        (valid if check.result() else stale).append(light)
+    return (valid, stale)
@@ -0,0 +1,111 @@
+"""
+Coalescing outbound queue for a single light
+
+Interactive controls (sliders, color pickers) can produce new states far
+faster than a light's HTTP server can take them. Writes queued here are
+merged while they wait: only the newest document of each kind is sent,
+and there is never more than one request in flight per light.
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from connection import get_executor
+
+# kinds of writes the queue knows how to send
+DATA = 'data'
+SETTINGS = 'settings'
+
+
+class CommandQueue:
+    """Last write wins queue in front of set_strip_data/set_strip_settings."""
+
+    def __init__(self, light):
+        """Init the queue for a light."""
+        self.light = light
+        self._lock = threading.Lock()
+        # kind -> (newest document, futures waiting on it)
+        self._pending = dict()
+        self._in_flight = False
+        self.submitted = 0
+        self.sent = 0
+        self.merged = 0
+        self.failed = 0
+
+    def submit(self, kind, document: dict) -> Future:
+        """
+        Queue a write of kind DATA or SETTINGS.
+
+        If a write of the same kind is still waiting it is replaced.
+        Returns a Future that resolves to True once the light accepted this
+        document, or a newer one that replaced it
+        """
+        if kind not in (DATA, SETTINGS):
+            raise ValueError(f"unknown write kind: {kind}")
+        future = Future()
+        with self._lock:
+            self.submitted += 1
+            waiters = [future]
+            if kind in self._pending:
+                self.merged += 1
+                waiters = self._pending[kind][1] + waiters
+            self._pending[kind] = (document, waiters)
+            if self._in_flight:
+                return future
+            self._in_flight = True
+        get_executor().submit(self._drain)
+        return future
+
+    def _send(self, kind, document: dict) -> bool:
+        """Send one document to the light."""
+        if kind == DATA:
+            return self.light.set_strip_data(document)
+        self.light.settings = document
+        return self.light.set_strip_settings()
+
+    def _drain(self):
+        """Send pending writes one at a time until none are left."""
+        log = logging.getLogger(__name__)
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        # cleared under the lock that saw the queue empty, so a
+                        # submit either lands in this drain or starts the next one
+                        self._in_flight = False
+                        return
+                    kind = next(iter(self._pending))
+                    document, waiters = self._pending.pop(kind)
+                # drop futures the caller cancelled, the rest can no longer be cancelled
+                waiters = [waiter for waiter in waiters if waiter.set_running_or_notify_cancel()]
+                try:
+                    success = self._send(kind, document)
+                except Exception as e:
+                    log.warning(f"Queued {kind} write to {self.light.full_addr} failed: {e}")
+                    success = False
+                with self._lock:
+                    self.sent += 1
+                    if not success:
+                        self.failed += 1
+                for waiter in waiters:
+                    waiter.set_result(success)
+        except BaseException:
+            # never leave the queue marked busy, the next submit starts a new drain
+            with self._lock:
+                self._in_flight = False
+            raise
+
+    def pending(self) -> int:
+        """Return the number of writes waiting to be sent."""
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        """Return how many writes were submitted, sent, merged and failed."""
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'sent': self.sent,
+                'merged': self.merged,
+                'failed': self.failed,
+                'pending': len(self._pending),
+            }
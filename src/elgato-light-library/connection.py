@@ -0,0 +1,70 @@
+"""
+Shared HTTP plumbing for talking to lights
+
+Every light in the process goes through one pooled keep-alive session,
+so fanning a command out to a room reuses the open sockets instead of
+doing a fresh TCP handshake per light per update.
+requests is only imported when the session is first needed, so importing
+the library stays fast.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# each light is its own host:port, so the pool needs one slot per light
+MAX_HOSTS = 256
+# requests to a single light are mostly sequential, a few spare sockets is plenty
+CONNECTIONS_PER_HOST = 4
+# number of requests that can be in flight at the same time
+MAX_WORKERS = 64
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+
+
+def get_session() -> 'requests.Session':
+    """Return the process wide session, creating it on first use."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=MAX_HOSTS,
+                pool_maxsize=CONNECTIONS_PER_HOST)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process wide worker pool used to fan requests out."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS,
+                thread_name_prefix='elgato')
+        return _executor
+
+
+async def run_async(func, *args, **kwargs):
+    """Run a blocking call on the shared pool without blocking the event loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def close():
+    """Close the shared session and worker pool."""
+    global _session, _executor
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
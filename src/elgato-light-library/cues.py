@@ -0,0 +1,270 @@
+"""
+Timelines of cues played across a room
+
+A Timeline is a list of cues, each one says "at this many seconds in,
+these lights show this color (or Scene)". A CueEngine turns it into a
+dispatch schedule before the show starts: lights are resolved, every
+request body is compiled, connections are opened and each light's round
+trip time is estimated (see latency.py). Each cue is then sent half a
+round trip early, so it lands on every light at the same moment even
+when some lights answer much more slowly than others.
+
+    timeline = Timeline()
+    timeline.add(0.0, (1, 0.0, 100.0, 50), tag='stage')
+    timeline.add(2.5, scene, product='Elgato Light Strip')
+    engine = CueEngine(room, timeline)
+    engine.prepare()
+    engine.start()
+    engine.wait()
+"""
+import logging
+import threading
+from collections import deque, namedtuple
+from time import monotonic, perf_counter
+from connection import get_executor
+from payload import compile_payload
+from room import state_document, send_shared, supports_state, LightResult
+from scheduler import get_scheduler
+
+# at (seconds from the start of the timeline), state is a color tuple or a Scene,
+# lights is a list of lights or None to pick them with criteria (see Room.select)
+Cue = namedtuple('Cue', ['at', 'state', 'lights', 'criteria', 'scene_name', 'scene_id'])
+# when a cue was sent to a light, late is how many seconds after its dispatch time it went out
+CueResult = namedtuple('CueResult', ['cue', 'light', 'dispatch', 'late', 'result'])
+
+# lights with fewer round trips on record than this are measured in prepare
+RTT_SAMPLES = 3
+RTT_TIMEOUT = 2
+
+
+class Timeline:
+    """Cues ordered by time."""
+
+    def __init__(self):
+        """Init an empty timeline."""
+        self.cues = []
+
+    def add(self, at: float, state, lights: list = None,
+            scene_name='cue-scene', scene_id='cue-scene-id', **criteria):
+        """
+        Add a cue at seconds from the start.
+
+        state is a color tuple (on, hue, saturation, brightness) or a Scene.
+        Targets lights, or the lights of the room matching criteria
+        (e.g. tag='stage'), or every light of the room if neither is given
+        Returns the timeline so calls can be chained
+        """
+        self.cues.append(Cue(at, state, lights, criteria, scene_name, scene_id))
+        return self
+
+    def add_frames(self, at: float, scene, lights: list = None, repeat: int = 1, **criteria):
+        """
+        Play the frames of a Scene as timed colors, starting at seconds from the start.
+
+        Every frame becomes a color cue when it starts, so the room steps
+        through the scene in lockstep instead of each light running it on its own
+        """
+        offset = 0
+        for _ in range(repeat):
+            for hue, saturation, brightness, durationMs, transitionMs in scene:
+                on = 1 if brightness > 0 else 0
+                self.add(at + offset / 1000, (on, hue, saturation, brightness), lights, **criteria)
+                offset += durationMs + transitionMs
+        return self
+
+    def duration(self) -> float:
+        """Return when the last cue starts."""
+        return max((cue.at for cue in self.cues), default=0.0)
+
+    def __len__(self):
+        return len(self.cues)
+
+
+def measure_rtt(light, samples: int = RTT_SAMPLES, timeout=RTT_TIMEOUT, q: float = None) -> float:
+    """
+    Return the round trip time of a light in seconds.
+
+    The light's latency estimate is used, it is only topped up with extra
+    requests when fewer than samples round trips are on record.
+    Also leaves a warm keep-alive connection to the light in the pool
+    """
+    for _ in range(samples - light.latency.count):
+        light.fetch_strip_data(timeout=timeout)
+    return light.latency.estimate(q) or 0.0
+
+
+class CueEngine:
+    """Play a Timeline on a Room with per light latency compensation."""
+
+    def __init__(self, room, timeline: Timeline, compensate=True, q: float = None):
+        """
+        Init the engine, call prepare and then start.
+
+        Set compensate=False to send every cue exactly at its time.
+        q plans with that quantile of each light's recent round trips
+        instead of their average, see LatencyEstimator
+        """
+        self.room = room
+        self.timeline = timeline
+        self.compensate = compensate
+        self.q = q
+        # light -> round trip time in seconds
+        self.rtt = dict()
+        # (dispatch offset, cue, light, document, payload) sorted by dispatch offset
+        self.schedule = []
+        self.results = []
+        self._calls = []
+        self._start = None
+        self._lock = threading.Lock()
+        # light -> cues that came due while the light was still busy with an earlier one
+        self._backlog = dict()
+        self._idle = threading.Condition(self._lock)
+
+    def _resolve(self, cue) -> list:
+        """Return the lights a cue targets."""
+        if cue.lights is not None:
+            return list(cue.lights)
+        return self.room.select(**cue.criteria)
+
+    def measure(self, lights: list):
+        """Estimate the round trip time of every light at once, lights that fail count as 0."""
+        log = logging.getLogger(__name__)
+        executor = get_executor()
+        futures = {
+            light: executor.submit(measure_rtt, light, RTT_SAMPLES, RTT_TIMEOUT, self.q)
+            for light in lights}
+        for light, future in futures.items():
+            try:
+                self.rtt[light] = future.result()
+            except Exception as e:
+                log.warning(f"Could not measure the round trip time of {light.full_addr}: {e}")
+                self.rtt[light] = 0.0
+
+    def prepare(self):
+        """
+        Work out everything that can be done before the show.
+
+        Resolves the lights of every cue, compiles each request body once,
+        measures round trip times and sorts the dispatch schedule
+        Returns the engine
+        """
+        log = logging.getLogger(__name__)
+        targets = []
+        lights = dict()
+        for cue in sorted(self.timeline.cues, key=lambda cue: cue.at):
+            document = state_document(cue.state, cue.scene_name, cue.scene_id)
+            payload = compile_payload(document)
+            for light in self._resolve(cue):
+                if not supports_state(light, cue.state):
+                    log.warning(f"{light.type} at {light.full_addr} cannot show the cue at {cue.at}s, skipping it")
+                    continue
+                lights[light] = None
+                targets.append((cue, light, document, payload))
+        if self.compensate:
+            self.measure(list(lights))
+        schedule = []
+        for cue, light, document, payload in targets:
+            # a request takes effect about half a round trip after it is sent
+            lead = self.rtt.get(light, 0.0) / 2 if self.compensate else 0.0
+            schedule.append((cue.at - lead, cue, light, document, payload))
+        schedule.sort(key=lambda item: item[0])
+        self.schedule = schedule
+        return self
+
+    def _send(self, dispatch, cue, light, document, payload) -> bool:
+        """Send one cue to one light and record how it went."""
+        late = monotonic() - (self._start + dispatch)
+        start = perf_counter()
+        try:
+            result = LightResult(
+                bool(send_shared(light, document, payload)), perf_counter() - start, None)
+        except Exception as e:
+            result = LightResult(False, perf_counter() - start, e)
+        with self._lock:
+            self.results.append(CueResult(cue, light, dispatch, late, result))
+        return result.success
+
+    def _fire(self, dispatch, cue, light, document, payload):
+        """
+        Send a cue that came due, one request per light at a time.
+
+        If the light is still busy with an earlier cue this one waits behind
+        it, so a light gets its cues in order and never two at once
+        """
+        item = (dispatch, cue, light, document, payload)
+        with self._lock:
+            if light in self._backlog:
+                self._backlog[light].append(item)
+                return
+            self._backlog[light] = deque()
+        while True:
+            self._send(*item)
+            with self._lock:
+                backlog = self._backlog.get(light)
+                if not backlog:
+                    self._backlog.pop(light, None)
+                    self._idle.notify_all()
+                    return
+                item = backlog.popleft()
+
+    def start(self, delay: float = 0.0) -> float:
+        """
+        Start the show delay seconds from now, prepares it first if needed.
+
+        Cues whose compensated dispatch time has already passed are sent
+        straight away, give a delay of at least the largest half round trip to avoid that
+        Returns the start time (time.monotonic)
+        """
+        if not self.schedule:
+            self.prepare()
+        self.stop()
+        self.results = []
+        self._start = monotonic() + delay
+        scheduler = get_scheduler()
+        self._calls = [
+            scheduler.call_at(
+                self._start + max(dispatch, -delay), self._fire,
+                dispatch, cue, light, document, payload)
+            for dispatch, cue, light, document, payload in self.schedule]
+        return self._start
+
+    def stop(self) -> int:
+        """Cancel every cue that has not been sent yet, returns how many were cancelled."""
+        cancelled = sum(1 for call in self._calls if call.cancel())
+        self._calls = []
+        with self._lock:
+            for backlog in self._backlog.values():
+                cancelled += len(backlog)
+                backlog.clear()
+        return cancelled
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Block until every cue was sent (or cancelled).
+
+        Returns True if every light accepted its cues
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        for call in list(self._calls):
+            left = None if deadline is None else max(0.0, deadline - monotonic())
+            if not call.wait(left):
+                return False
+        left = None if deadline is None else max(0.0, deadline - monotonic())
+        with self._idle:
+            if not self._idle.wait_for(lambda: not self._backlog, left):
+                return False
+        return all(result.result.success for result in self.results)
+
+    def spread(self) -> float:
+        """
+        Return the largest difference in landing time between lights sharing a cue.
+
+        Landing time is when the request went out plus half the light's round trip
+        """
+        landings = dict()
+        with self._lock:
+            for result in self.results:
+                sent = self._start + result.dispatch + result.late
+                landing = sent + self.rtt.get(result.light, 0.0) / 2
+                landings.setdefault(id(result.cue), []).append(landing)
+        return max((max(times) - min(times) for times in landings.values()), default=0.0)
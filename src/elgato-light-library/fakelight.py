@@ -0,0 +1,232 @@
+"""
+Local stand-in for Elgato lights
+
+Implements /elgato/lights, /elgato/lights/settings and
+/elgato/accessory-info closely enough for the library to talk to it, with
+configurable latency, jitter and failure rate. A FakeFleet runs many of
+them on different ports so benchmarks can simulate a full room.
+
+    $ python fakelight.py --count 50
+"""
+import argparse
+import json
+import logging
+import random
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+
+class FakeLight:
+    """State of a single fake light."""
+
+    def __init__(self, serial_number, product_name='Elgato Light Strip'):
+        """Init the light with the documents a real light strip reports."""
+        self.lock = threading.Lock()
+        self.data = {
+            'numberOfLights': 1,
+            'lights': [
+                {'on': 1, 'hue': 0.0, 'saturation': 0.0, 'brightness': 50}
+            ]
+        }
+        self.settings = {
+            'powerOnBehavior': 1,
+            'powerOnBrightness': 50,
+            'switchOnDurationMs': 150,
+            'switchOffDurationMs': 400,
+            'colorChangeDurationMs': 150,
+        }
+        self.info = {
+            'productName': product_name,
+            'hardwareBoardType': 70,
+            'firmwareBuildNumber': 219,
+            'firmwareVersion': '1.0.4',
+            'serialNumber': serial_number,
+            'displayName': f'Fake {serial_number}',
+            'features': ['lights'],
+        }
+        self.requests = 0
+
+    def put_data(self, document: dict) -> dict:
+        """Apply a (possibly partial) /elgato/lights document like a real light."""
+        with self.lock:
+            for light, update in zip(self.data['lights'], document.get('lights', [])):
+                scene = 'scene' in update or 'name' in update
+                color = 'hue' in update or 'saturation' in update
+                if scene:
+                    light.pop('hue', None)
+                    light.pop('saturation', None)
+                elif color:
+                    for key in ('id', 'name', 'numberOfSceneElements', 'scene'):
+                        light.pop(key, None)
+                light.update(update)
+            return self.data
+
+
+class FakeLightServer:
+    """HTTP server for one FakeLight."""
+
+    def __init__(self,
+                 light: FakeLight,
+                 host='127.0.0.1',
+                 port=0,
+                 latency=0.0,
+                 jitter=0.0,
+                 failure_rate=0.0):
+        """
+        Init the server, port 0 picks a free port.
+
+        latency and jitter are in seconds, every request waits
+        latency +/- a random amount up to jitter.
+        failure_rate is the chance that a request gets a 503
+        """
+        self.light = light
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.addr, self.port = self.httpd.server_address
+        self._thread = None
+
+    def _handler(self):
+        """Build the request handler class bound to this server."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # lights answer small requests, do not let Nagle delay them
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                logging.getLogger(__name__).debug(format % args)
+
+            def _reply(self, status, document=None):
+                body = json.dumps(document).encode() if document is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _simulate(self) -> bool:
+                """Wait like a real light would, returns False if this request should fail."""
+                with server.light.lock:
+                    server.light.requests += 1
+                delay = server.latency + random.uniform(-server.jitter, server.jitter)
+                if delay > 0:
+                    sleep(delay)
+                return random.random() >= server.failure_rate
+
+            def do_GET(self):
+                documents = {
+                    '/elgato/lights': server.light.data,
+                    '/elgato/lights/settings': server.light.settings,
+                    '/elgato/accessory-info': server.light.info,
+                }
+                if self.path not in documents:
+                    return self._reply(404)
+                if not self._simulate():
+                    return self._reply(503)
+                with server.light.lock:
+                    self._reply(200, documents[self.path])
+
+            def do_PUT(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    document = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    return self._reply(400)
+                if self.path not in ('/elgato/lights', '/elgato/lights/settings', '/elgato/accessory-info'):
+                    return self._reply(404)
+                if not self._simulate():
+                    return self._reply(503)
+                if self.path == '/elgato/lights':
+                    return self._reply(200, server.light.put_data(document))
+                with server.light.lock:
+                    target = server.light.settings if self.path == '/elgato/lights/settings' else server.light.info
+                    target.update(document)
+                    self._reply(200, target)
+
+        return Handler
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name=f'fakelight-{self.port}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeFleet:
+    """Many fake lights, each on its own port."""
+
+    def __init__(self,
+                 count,
+                 host='127.0.0.1',
+                 latency=0.0,
+                 jitter=0.0,
+                 failure_rate=0.0,
+                 product_name='Elgato Light Strip'):
+        """Init count fake lights with the same network behaviour."""
+        self.servers = [
+            FakeLightServer(
+                FakeLight(f'FAKE{index:05d}', product_name),
+                host, 0, latency, jitter, failure_rate)
+            for index in range(count)]
+
+    def start(self):
+        """Start every server."""
+        for server in self.servers:
+            server.start()
+        return self
+
+    def stop(self):
+        """Stop every server."""
+        for server in self.servers:
+            server.stop()
+
+    def addresses(self) -> list:
+        """Return the (addr, port) of every light, ready for find_light_strips_manual."""
+        return [(server.addr, server.port) for server in self.servers]
+
+    def requests(self) -> int:
+        """Return the total number of requests the fleet answered."""
+        return sum(server.light.requests for server in self.servers)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """Run a fleet of fake lights until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    with FakeFleet(args.count, args.host, args.latency, args.jitter, args.failure_rate) as fleet:
+        for addr, port in fleet.addresses():
+            print(f"{addr}:{port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
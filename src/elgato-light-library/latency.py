@@ -0,0 +1,92 @@
+"""
+Round trip time estimation per light
+
+Every request a light answers is timed and fed to its LatencyEstimator,
+so the estimate follows normal traffic (commands, polling) without
+sending anything extra. The estimator keeps an exponentially weighted
+moving average for a quick typical value and a window of recent samples
+for percentiles, which matter on congested Wi-Fi where a light's round
+trip can jump from 5ms to 200ms.
+
+Lights have no clock that can be read, so the delay until a command
+takes effect is taken to be half the round trip. dispatch_times uses it
+to send to slow lights earlier so a room-wide change lands everywhere
+at once.
+"""
+import threading
+from collections import deque
+from time import monotonic
+
+# weight of a new sample in the moving average
+EWMA_ALPHA = 0.2
+# recent samples kept for percentiles
+WINDOW = 64
+
+
+class LatencyEstimator:
+    """Moving average and percentiles of a light's round trip times."""
+
+    def __init__(self, alpha: float = EWMA_ALPHA, window: int = WINDOW):
+        """Init an estimator with no samples."""
+        self.alpha = alpha
+        self.ewma = None
+        self.count = 0
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    def record(self, rtt: float):
+        """Add a round trip time in seconds."""
+        with self._lock:
+            self.ewma = rtt if self.ewma is None else self.ewma + self.alpha * (rtt - self.ewma)
+            self.count += 1
+            self._samples.append(rtt)
+            self._sorted = None
+
+    def percentile(self, q: float):
+        """Return the q quantile (0-1) of the recent samples, None without samples."""
+        with self._lock:
+            if not self._samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+            return self._sorted[index]
+
+    def estimate(self, q: float = None):
+        """
+        Return the round trip time to plan with, None without samples.
+
+        The moving average by default, or the q quantile of recent samples
+        to plan for a slower than usual round trip
+        """
+        if q is not None:
+            return self.percentile(q)
+        return self.ewma
+
+    def one_way(self, q: float = None, default: float = 0.0) -> float:
+        """Return how long a command takes to reach the light, half the round trip."""
+        rtt = self.estimate(q)
+        return default if rtt is None else rtt / 2
+
+    def reset(self):
+        """Forget every sample, e.g. after the light moved."""
+        with self._lock:
+            self.ewma = None
+            self.count = 0
+            self._samples.clear()
+            self._sorted = None
+
+
+def dispatch_times(lights, land_at: float = None, q: float = None, margin: float = 0.0) -> dict:
+    """
+    Work out when to send to each light so the command lands on all of them at once.
+
+    land_at is a time.monotonic() time, by default as soon as the slowest
+    light can make it (plus margin). Lights without samples count as instant.
+    Returns a dictionary of light -> send time (time.monotonic)
+    """
+    delays = {light: light.latency.one_way(q) for light in lights}
+    if land_at is None:
+        land_at = monotonic() + max(delays.values(), default=0.0) + margin
+    return {light: land_at - delay for light, delay in delays.items()}
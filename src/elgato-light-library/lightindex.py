@@ -0,0 +1,164 @@
+"""
+Indexes over a collection of lights
+
+Lets a Room find lights by address, serial number, display name, product
+type or user tags without scanning every light, and combine those
+lookups to pick out subsets of a large room.
+"""
+import threading
+
+# attributes every light is indexed on, name -> how to read it from a light
+KEYS = {
+    'addr': lambda light: light.addr,
+    'full_addr': lambda light: light.full_addr,
+    'serial': lambda light: light.info.get('serialNumber'),
+    'name': lambda light: light.info.get('displayName'),
+    'product': lambda light: light.info.get('productName'),
+}
+
+
+class LightIndex:
+    """Lights indexed by address, serial, display name, product type and tags."""
+
+    def __init__(self, lights=()):
+        """Init the index with some lights."""
+        self._lock = threading.RLock()
+        # dicts with None values are used as insertion ordered sets
+        self._lights = dict()
+        self._indexes = {key: dict() for key in KEYS}
+        self._tags = dict()
+        # what each light was indexed under, so it can be removed even after it changed
+        self._indexed_as = dict()
+        self._light_tags = dict()
+        for light in lights:
+            self.add(light)
+
+    def add(self, light):
+        """Add a light, or re-index it if it is already in."""
+        with self._lock:
+            if light in self._lights:
+                self._unindex(light)
+            self._lights[light] = None
+            values = {key: read(light) for key, read in KEYS.items()}
+            for key, value in values.items():
+                if value is not None:
+                    self._indexes[key].setdefault(value, dict())[light] = None
+            self._indexed_as[light] = values
+            for tag in self._light_tags.get(light, ()):
+                self._tags.setdefault(tag, dict())[light] = None
+
+    def update(self, light):
+        """Re-index a light whose address or info changed."""
+        self.add(light)
+
+    def _unindex(self, light):
+        """Remove a light from the attribute and tag indexes."""
+        for key, value in self._indexed_as.pop(light, {}).items():
+            group = self._indexes[key].get(value)
+            if group is not None:
+                group.pop(light, None)
+                if not group:
+                    del self._indexes[key][value]
+        for tag in self._light_tags.get(light, ()):
+            group = self._tags.get(tag)
+            if group is not None:
+                group.pop(light, None)
+                if not group:
+                    del self._tags[tag]
+
+    def remove(self, light) -> bool:
+        """Remove a light, returns False if it was not indexed."""
+        with self._lock:
+            if light not in self._lights:
+                return False
+            self._unindex(light)
+            del self._lights[light]
+            self._light_tags.pop(light, None)
+            return True
+
+    def clear(self):
+        """Remove every light."""
+        with self._lock:
+            for light in list(self._lights):
+                self.remove(light)
+
+    def replace(self, lights):
+        """
+        Make the index hold exactly lights.
+
+        Lights that stay keep their tags
+        """
+        with self._lock:
+            lights = list(lights)
+            keep = set(lights)
+            for light in list(self._lights):
+                if light not in keep:
+                    self.remove(light)
+            for light in lights:
+                if light not in self._lights:
+                    self.add(light)
+
+    def tag(self, light, *tags):
+        """Attach user tags to a light."""
+        with self._lock:
+            self._light_tags.setdefault(light, set()).update(tags)
+            if light in self._lights:
+                for tag in tags:
+                    self._tags.setdefault(tag, dict())[light] = None
+
+    def untag(self, light, *tags):
+        """Remove user tags from a light."""
+        with self._lock:
+            self._light_tags.get(light, set()).difference_update(tags)
+            for tag in tags:
+                group = self._tags.get(tag)
+                if group is not None:
+                    group.pop(light, None)
+                    if not group:
+                        del self._tags[tag]
+
+    def tags(self, light) -> set:
+        """Return the tags of a light."""
+        with self._lock:
+            return set(self._light_tags.get(light, ()))
+
+    def find(self, key, value) -> list:
+        """Return the lights whose key (see KEYS, or 'tag') equals value."""
+        with self._lock:
+            if key == 'tag':
+                return list(self._tags.get(value, ()))
+            return list(self._indexes[key].get(value, ()))
+
+    def get(self, key, value):
+        """Return the single light whose key equals value, or None."""
+        found = self.find(key, value)
+        return found[0] if found else None
+
+    def select(self, **criteria) -> list:
+        """
+        Return the lights that match every criterion.
+
+        e.g. select(product='Elgato Light Strip', tag='stage')
+        Criteria are any of the KEYS or 'tag', with no criteria every light is returned
+        """
+        with self._lock:
+            if not criteria:
+                return list(self._lights)
+            groups = sorted(
+                (self.find(key, value) for key, value in criteria.items()), key=len)
+            matches = set(groups[0])
+            for group in groups[1:]:
+                matches.intersection_update(group)
+            # keep the order lights were added in
+            return [light for light in groups[0] if light in matches]
+
+    def lights(self) -> list:
+        """Return every light in the order they were added."""
+        with self._lock:
+            return list(self._lights)
+
+    def __len__(self):
+        return len(self._lights)
+
+    def __contains__(self, light):
+        return light in self._lights
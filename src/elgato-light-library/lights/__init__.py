@@ -0,0 +1,9 @@
+"""
+Light classes, one per product family
+
+Importing the package registers every product, so Light.from_info can
+build the right class from the productName a light reports.
+"""
+from lights.light import Light, register_product, PRODUCTS, COLOR, TEMPERATURE, SCENES
+from lights.lightstrip import LightStrip
+from lights.keylight import KeyLight
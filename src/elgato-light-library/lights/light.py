@@ -2,43 +2,223 @@
 Light class that contains common elements of all lights
 
 all other light classes (Keylight, Lightstrip, etc) should inherit this
+and register the productNames they handle with register_product, so
+from_info can build the right class without this module importing them
 """
-import requests
+import copy
 import json
 import logging
-from lightstrip import LightStrip
-from keylight import KeyLight
+from time import monotonic
+from connection import get_executor, get_session, run_async
+from policy import CircuitBreaker, CircuitOpenError, get_policy
+from latency import LatencyEstimator
+from commandqueue import CommandQueue, DATA, SETTINGS
+from payload import compile_payload
+
+HTTP_OK = 200
+
+# what a product can do, subclasses list theirs in capabilities
+COLOR = 'color'              # hue and saturation
+TEMPERATURE = 'temperature'  # white light color temperature
+SCENES = 'scenes'            # looping scenes run by the light itself
+
+# productName -> Light subclass, filled in by register_product
+PRODUCTS = dict()
+
+# keys that describe a scene, they only make sense when sent together
+SCENE_KEYS = ('id', 'name', 'numberOfSceneElements', 'scene')
+
+
+def _is_scene(light: dict) -> bool:
+    """Check if a single entry of data['lights'] is a scene."""
+    return 'scene' in light or 'name' in light
+
+
+def diff_data(acked: dict, data: dict):
+    """
+    Work out the smallest /elgato/lights document that turns acked into data.
+
+    Returns None when nothing changed.
+    If acked is unknown, or every light switches between a static color and
+    a scene or gets a new scene, data itself is returned
+    """
+    if acked is None or len(acked.get('lights', [])) != len(data['lights']):
+        return data
+    lights = []
+    changed = False
+    whole = True
+    for old, new in zip(acked['lights'], data['lights']):
+        delta = {key: value for key, value in new.items() if old.get(key) != value}
+        # a new scene or a switch between color and scene needs the whole light
+        if _is_scene(old) != _is_scene(new) or any(key in SCENE_KEYS for key in delta):
+            lights.append(new)
+            changed = True
+            continue
+        whole = False
+        changed = changed or bool(delta)
+        lights.append(delta)
+    if not changed:
+        return None
+    if whole:
+        return data
+    return {'numberOfLights': data['numberOfLights'], 'lights': lights}
+
+
+def register_product(*product_names):
+    """
+    Class decorator that makes from_info build the class for these productNames.
+
+        @register_product('Elgato Key Light', 'Elgato Key Light Air')
+        class KeyLight(Light):
+    """
+    def register(cls):
+        for product_name in product_names:
+            PRODUCTS[product_name] = cls
+        return cls
+    return register
+
+
+def diff_settings(acked: dict, settings: dict):
+    """Return the settings that differ from acked, None when nothing changed."""
+    if acked is None:
+        return settings
+    delta = {key: value for key, value in settings.items() if acked.get(key) != value}
+    return delta or None
+
 
 class Light:
-    # available subclasses that have custom features
-    _subclasses = {'Strip': LightStrip, 'Key': KeyLight}
-    def __init__(self, addr, port, name="") -> None:
+    # what this product can do, see COLOR, TEMPERATURE and SCENES
+    capabilities = frozenset()
+
+    def __init__(self, addr, port, name="", info: dict = None) -> None:
         """
         All of the lights share these attributes
+
+        If the accessory info has already been fetched (e.g. by detect_type)
+        pass it in so it is not requested again.
+        data and settings are only fetched the first time they are used,
+        call prefetch to load both at once.
         """
-        self.type = type
         self.addr = addr
         self.port = port
         self.name = name
         self.full_addr = self.addr + ':' + str(self.port)
-        self.get_strip_data()  # fill in the data/info/settings of the light
-        self.get_strip_info()
-        self.get_strip_settings()
+        self._data = None
+        self._settings = None
+        # last state the light confirmed, used to only send what changed
+        self._acked_data = None
+        self._acked_settings = None
+        # when _acked_data was last confirmed by the light (time.monotonic)
+        self._acked_time = None
+        # coalesces writes from interactive controls, see queue_strip_data
+        self.commands = CommandQueue(self)
+        # timeouts and retries, None uses the shared policy (see policy.py)
+        self.policy = None
+        # skips the light while it is not answering
+        self.breaker = CircuitBreaker(self._probe, name=self.full_addr)
+        # round trip times of the requests the light answered
+        self.latency = LatencyEstimator()
+        if info is None:
+            self.get_strip_info()
+        else:
+            self.info = info
         self.type = self.info['productName']
-    
-    def detect_type(addr, port, name="") -> KeyLight | LightStrip:
+
+    def supports(self, capability) -> bool:
+        """Check if the light has a capability (COLOR, TEMPERATURE or SCENES)."""
+        return capability in self.capabilities
+
+    def move(self, addr, port):
+        """Point the light at a new address, e.g. after its IP changed."""
+        self.addr = addr
+        self.port = port
+        self.full_addr = self.addr + ':' + str(self.port)
+        # the old address failing says nothing about the new one
+        self.breaker.name = self.full_addr
+        self.breaker.reset()
+        self.latency.reset()
+
+    def _request(self, method, path, timeout=None, retry=True, **kwargs):
+        """
+        Send a request to the light following its policy.
+
+        Raises CircuitOpenError without sending anything while the light is down
+        """
+        policy = self.policy or get_policy()
+        return policy.request(
+            method, 'http://' + self.full_addr + path, self.breaker, timeout, retry,
+            self.latency, **kwargs)
+
+    def _probe(self) -> bool:
+        """Check if the light answers, used by the breaker while it is open."""
+        policy = self.policy or get_policy()
+        r = get_session().get(
+            'http://' + self.full_addr + '/elgato/accessory-info',
+            verify=False, timeout=policy.timeout)
+        return r.status_code == HTTP_OK
+
+    @property
+    def data(self) -> dict:
+        """State of the light from /elgato/lights, fetched on first use."""
+        if self._data is None:
+            self.get_strip_data()
+        return self._data
+
+    @data.setter
+    def data(self, value: dict):
+        self._data = value
+
+    @property
+    def settings(self) -> dict:
+        """Settings of the light from /elgato/lights/settings, fetched on first use."""
+        if self._settings is None:
+            self.get_strip_settings()
+        return self._settings
+
+    @settings.setter
+    def settings(self, value: dict):
+        self._settings = value
+
+    def prefetch(self):
+        """Fetch the data and settings of the light concurrently."""
+        executor = get_executor()
+        futures = [
+            executor.submit(self.get_strip_data),
+            executor.submit(self.get_strip_settings)]
+        for future in futures:
+            future.result()
+        return self
+
+    def detect_type(addr, port, name="", prefetch=False, timeout=None) -> 'Light':
         """
         Given an address, figure out which subclass should be made and return that subclass
+
+        The accessory info is only requested once and handed to the new light.
+        Set prefetch to also load data and settings (in parallel) up front.
+        timeout (seconds) bounds how long to wait on a host that does not answer.
+        """
+        if timeout is None:
+            timeout = get_policy().timeout
+        info = get_session().get(f'http://{addr}:{port}/elgato/accessory-info',
+            verify=False, timeout=timeout).json()
+        light = Light.from_info(addr, port, info, name=name)
+        if prefetch:
+            light.prefetch()
+        return light
+
+    def from_info(addr, port, info: dict, name="") -> 'Light':
+        """
+        Create the right subclass for a light whose accessory info is already known
+
+        The class is looked up by productName, see register_product
+        Does not send any requests
         """
         log = logging.getLogger(__name__)
-        info = requests.get(f'http://{addr}:{port}/elgato/accessory-info',
-            verify=False).json()
         light_type = info['productName']
-        if light_type in Light._subclasses:
-            return Light._subclasses[light_type](addr, port, name=name)
-        else:
-            log.warning(f"A subclass was not found for product: {light_type}")
-            return Light(addr, port, name=name)
+        if light_type in PRODUCTS:
+            return PRODUCTS[light_type](addr, port, name=name, info=info)
+        log.warning(f"A subclass was not found for product: {light_type}")
+        return Light(addr, port, name=name, info=info)
 
     def get_strip_data(self):
         """
@@ -47,78 +227,164 @@ class Light:
             format:
             http://<IP>:<port>/elgato/lights
         """
-        log = logging.getLogger(__name__)
-        self.data = requests.get(
-            'http://' + self.full_addr + '/elgato/lights',
-            verify=False).json()
-        log.info(f"recieved data on /elgato/lights:\n{self.data}")
+        self.data = self.fetch_strip_data()
         return self.data
 
-    def get_strip_info(self):
+    def fetch_strip_data(self, timeout=None, retry=True) -> dict:
+        """
+        Get /elgato/lights without touching self.data.
+
+        Only the record of what the light is showing is updated, so this is
+        safe to call from a background poller while self.data is being edited
+        retry=False sends the request only once, see RequestPolicy
+        """
+        log = logging.getLogger(__name__)
+        data = self._request(
+            'GET', '/elgato/lights', timeout, retry, verify=False).json()
+        self._acked_data = data
+        self._acked_time = monotonic()
+        log.info(f"recieved data on /elgato/lights:\n{data}")
+        return copy.deepcopy(data)
+
+    def get_strip_state(self, max_age: float = None) -> dict:
+        """
+        Return what the light is showing.
+
+        The last known state is reused if it is at most max_age seconds old
+        (e.g. kept fresh by a StatePoller), otherwise the light is asked
+        """
+        if (max_age is None or self._acked_time is None
+                or monotonic() - self._acked_time > max_age):
+            return self.fetch_strip_data()
+        return copy.deepcopy(self._acked_data)
+
+    def get_strip_info(self, timeout=None):
         """Send a get request to the light."""
         log = logging.getLogger(__name__)
-        self.info = requests.get(
-            'http://' + self.full_addr + '/elgato/accessory-info',
-            verify=False).json()
+        self.info = self._request(
+            'GET', '/elgato/accessory-info', timeout, verify=False).json()
         log.info(f"recieved data on /elgato/accessory-info:\n{self.info}")
         return self.info
 
-    def get_strip_settings(self):
+    def get_strip_settings(self, timeout=None):
         """Get the strip's settings."""
         log = logging.getLogger(__name__)
-        self.settings = requests.get(
-            'http://' + self.full_addr + '/elgato/lights/settings',
-            verify=False).json()
+        self.settings = self._request(
+            'GET', '/elgato/lights/settings', timeout, verify=False).json()
+        self._acked_settings = copy.deepcopy(self.settings)
         log.info(f"recieved data on /elgato/lights/settings:\n{self.settings}")
         return self.settings
 
-    def set_strip_data(self) -> bool:
+    def set_strip_data(self, data: dict = None, force=False, payload: bytes = None) -> bool:
         """
         Send a put request to update the light data.
 
+        If data is given it replaces self.data before sending
+        Only the fields that differ from the last state the light accepted are
+        sent, and if nothing changed no request is made at all.
+        Set force to send the whole document regardless, e.g. when something
+        other than this object may have changed the light
+        payload is an already compiled body of the whole document (see payload.py),
+        it is sent as is whenever the whole document has to go out
         Returns True if successful
-        TODO: investigate if sending the entire JSON is necessary or if we can just send the things that need to be changed
-        TODO: investigate just sending self.data
+        """
+        return self.send_strip_data(data, force, payload)[0]
+
+    def send_strip_data(self, data: dict = None, force=False, payload: bytes = None) -> tuple:
+        """
+        set_strip_data that also tells whether a request went out.
+
+        Returns (True if successful, True if a PUT was sent), the second is
+        False when the light already had the data or its breaker is open
         """
         log = logging.getLogger(__name__)
+        if data is not None:
+            self.data = data
+        document = self.data if force else diff_data(self._acked_data, self.data)
+        if document is None:
+            log.debug(f"{self.full_addr} already has this data, not sending it")
+            return (True, False)
+        if payload is None or document is not self.data:
+            payload = compile_payload(document)
         try:
-            r = requests.put(
-                'http://' + self.full_addr + '/elgato/lights',
-                data=json.dumps(self.data))
-            # if the request was accepted, modify self.data
-            if r.status_code == requests.codes.ok:
-                return True
+            r = self._request('PUT', '/elgato/lights', data=payload)
+            # if the request was accepted, remember what the light is set to
+            if r.status_code == HTTP_OK:
+                self._acked_data = copy.deepcopy(self.data)
+                self._acked_time = monotonic()
+                return (True, True)
+        except CircuitOpenError as e:
+            log.debug(e)
+            return (False, False)
         except Exception as e:
             log.warning(f"Error encountered when setting strip data for {self.full_addr}.\n{e}")
-        return False
+        return (False, True)
 
-    def set_strip_settings(self) -> bool:
+    def set_strip_settings(self, force=False) -> bool:
         """
         Send a put request to update the light settings.
 
+        Like set_strip_data only the settings that changed are sent
         Returns True on success
         """
         log = logging.getLogger(__name__)
+        document = self.settings if force else diff_settings(self._acked_settings, self.settings)
+        if document is None:
+            log.debug(f"{self.full_addr} already has these settings, not sending them")
+            return True
         try:
-            r = requests.put(
-                'http://' + self.full_addr + '/elgato/lights/settings',
-                data=json.dumps(self.settings))
-            if r.status_code == requests.codes.ok:
+            r = self._request('PUT', '/elgato/lights/settings', data=compile_payload(document))
+            if r.status_code == HTTP_OK:
+                self._acked_settings = copy.deepcopy(self.settings)
                 return True
+        except CircuitOpenError as e:
+            log.debug(e)
         except Exception as e:
             log.warning(f"Error encountered when setting strip settings for {self.full_addr}.\n{e}")
         return False
 
+    def queue_strip_data(self, data: dict):
+        """
+        Queue data to be sent to the light without blocking.
+
+        If an older queued document has not been sent yet it is dropped in
+        favour of this one, see CommandQueue
+        Returns a Future that resolves to True once the light accepted it
+        """
+        return self.commands.submit(DATA, data)
+
+    def queue_strip_settings(self, settings: dict):
+        """Queue settings to be sent to the light, see queue_strip_data."""
+        return self.commands.submit(SETTINGS, settings)
+
     def set_strip_info(self) -> bool:
         """Set the strip info."""
         log = logging.getLogger(__name__)
         try:
-            r = requests.put(
-                'http://' + self.full_addr + '/elgato/accessory-info',
-                data=json.dumps(self.info))
-            if r.status_code == requests.codes.ok:
+            r = self._request('PUT', '/elgato/accessory-info', data=json.dumps(self.info))
+            if r.status_code == HTTP_OK:
                 return True
             print(r.text)
         except Exception as e:
             log.warning(f"Error encountered when setting strip info for {self.full_addr}.\n{e}")
-        return False
\ No newline at end of file
+        return False
+
+    async def async_get_strip_data(self):
+        """Async version of get_strip_data."""
+        return await run_async(self.get_strip_data)
+
+    async def async_get_strip_info(self):
+        """Async version of get_strip_info."""
+        return await run_async(self.get_strip_info)
+
+    async def async_get_strip_settings(self):
+        """Async version of get_strip_settings."""
+        return await run_async(self.get_strip_settings)
+
+    async def async_set_strip_data(self, data: dict = None, force=False, payload: bytes = None) -> bool:
+        """Async version of set_strip_data."""
+        return await run_async(self.set_strip_data, data, force, payload)
+
+    async def async_set_strip_settings(self, force=False) -> bool:
+        """Async version of set_strip_settings."""
+        return await run_async(self.set_strip_settings, force)
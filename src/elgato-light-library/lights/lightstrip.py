@@ -1,5 +1,12 @@
-from scene import Scene
-from light import Light
+import logging
+
+from scene import Scene, shared_scene
+from lights.light import Light, register_product, COLOR, SCENES
+from payload import color_document, color_payload, scene_payload
+from connection import run_async
+
+
+@register_product('Elgato Light Strip')
 class LightStrip(Light):
     """
     LightStrip language.
@@ -27,30 +34,36 @@ class LightStrip(Light):
                     'transitionMs'              : int
             when there is a 'scene', the light loops through each item in the scene
     """
+    capabilities = frozenset({COLOR, SCENES})
 
-    def __init__(self, addr, port, name=""):
+    def __init__(self, addr, port, name="", info: dict = None):
         """Initialize the light."""
-        super().__init__('lightstrip', addr, port, name)
-        self.is_scene = False
-        if 'scene' in self.data['lights'][0]:
-            self.is_scene = True
-            self.scene = Scene(self.data['lights'][0]['scene'])
-        elif 'name' in self.data['lights'][0]:
-            self.is_scene = True
-  
+        super().__init__(addr, port, name, info)
+
+    @property
+    def is_scene(self) -> bool:
+        """True when the light is running a scene instead of a static color."""
+        light = self.data['lights'][0]
+        return 'scene' in light or 'name' in light
+
     def from_light(light: Light):
         """Create a lightstrip from a Light object"""
-        return LightStrip(light.addr, light.port, light.name)
-    
-    def get_strip_color(self):
+        return LightStrip(light.addr, light.port, light.name, light.info)
+
+    def get_strip_color(self, max_age: float = None):
         """
         Return the color of the light.
 
             If the light is not set to a specific color
             (i.e. when it is in a scene) then the tuple is empty
+            With max_age the last known state is used if it is fresh enough,
+            see get_strip_state
         """
         try:
-            light_color = self.get_strip_data()['lights'][0]
+            if max_age is None:
+                light_color = self.get_strip_data()['lights'][0]
+            else:
+                light_color = self.get_strip_state(max_age)['lights'][0]
             return (
                 light_color['on'],
                 light_color['hue'],
@@ -61,40 +74,44 @@ class LightStrip(Light):
 
     def update_color(self, on, hue, saturation, brightness) -> bool:
         """User friendly way to interact with json data to change the color."""
-        self.data = {
-            'numberOfLights': 1,
-            'lights': [
-                {'on': on,
-                 'hue': hue,
-                 'saturation': saturation,
-                 'brightness': brightness}
-            ]
-        }
-        return self.set_strip_data(self.data)
+        self.data = color_document(on, hue, saturation, brightness)
+        return self.set_strip_data(
+            payload=color_payload(self.type, on, hue, saturation, brightness))
+
+    def queue_color(self, on, hue, saturation, brightness):
+        """
+        Non-blocking update_color for interactive controls.
+
+        Colors queued faster than the light can take them are merged
+        and only the newest one is sent
+        Returns a Future that resolves to True once the light accepted it
+        """
+        return self.queue_strip_data(color_document(on, hue, saturation, brightness))
 
     def update_scene_data(self, scene,
                           scene_name="transition-scene",
                           scene_id="",
                           brightness: float = 100.0):
         """Update just the scene data."""
-        print("updating scene data")
+        log = logging.getLogger(__name__)
+        log.debug("updating scene data")
         if not self.is_scene:
-            print("light strip is not currently assigned to a scene, autogenerating")
+            log.debug("light strip is not currently assigned to a scene, autogenerating")
             self.make_scene(scene_name, scene_id)
 
-        if not scene:
-            print("assigining scene by name")
+        if scene is None:
+            log.debug("assigining scene by name")
             self.data['lights'][0]['name'] = scene_name
             if scene_id:
-                print("also assigining scene by id")
+                log.debug("also assigining scene by id")
                 self.data['lights'][0]['id'] = scene_id
-            print("purging scene data")
+            log.debug("purging scene data")
             if not self.data['lights'][0].pop('scene'):
-                print("scene was not specified")
+                log.debug("scene was not specified")
             if not self.data['lights'][0].pop('numberOfSceneElements'):
-                print("number of scene elements was not specified")
+                log.debug("number of scene elements was not specified")
         else:
-            print("scene:", scene)
+            log.debug(f"scene: {scene}")
             assert type(scene) is Scene, "scene is not a list"
             self.data['lights'][0]['scene'] = scene.data
             self.data['lights'][0]['numberOfSceneElements'] = len(scene.data)
@@ -117,7 +134,6 @@ class LightStrip(Light):
                  }
             ]
         }
-        self.is_scene = True
         # if you do not specify an empty scene,
         # it might copy old scene data... annoying
         self.scene = Scene([])
@@ -138,32 +154,27 @@ class LightStrip(Light):
         TODO: see if you can pick a different way to cycle between colors in a scene
         """
         # print("---------transition starting")
-        self.make_scene(name, scene_id, 100)
+        frames = []
         wait_time_ms = 0
         # check if the light has already been set to a color,
         # and if it has, make that color the start of the transition scene
         if current_color := self.get_strip_color():
             _, hue, saturation, brightness = current_color
-            self.scene.add_scene(
-                hue,
-                saturation,
-                brightness,
-                colors[0][3],
-                colors[0][4])
+            frames.append((hue, saturation, brightness, colors[0][3], colors[0][4]))
             wait_time_ms += colors[0][4] + colors[0][3]
         # add the colors in the new scene
         for color in colors:
             hue, saturation, brightness, durationMs, transitionMs = color
-            self.scene.add_scene(
-                hue,
-                saturation,
-                brightness,
-                durationMs,
-                transitionMs)
+            frames.append((hue, saturation, brightness, durationMs, transitionMs))
             wait_time_ms += durationMs + transitionMs
-        # update the light with the new scene
+        # replaying the same transition reuses the same compiled payload,
+        # the light keeps its own copy of the shared scene so editing it is safe
+        self.make_scene(name, scene_id, 100)
+        shared = shared_scene(tuple(frames))
+        self.scene = shared.copy()
         self.update_scene_data(self.scene, scene_name=name, scene_id=scene_id)
-        self.set_strip_data(self.data)
+        self.set_strip_data(
+            payload=scene_payload(self.type, shared, name, scene_id, 100))
         # return the wait time
         return (wait_time_ms - colors[-1][3] - colors[-1][4]) / 1000
 
@@ -195,11 +206,28 @@ class LightStrip(Light):
             # TODO: make scene brightness variable
             # print("setting transition to end on a scene")
             self.make_scene(end_scene_name, end_scene_id, 100)
-            self.scene = Scene([])
-            for item in end_scene:
-                hue, saturation, brightness, durationMs, transitionMs = item
-                self.scene.add_scene(
-                    hue, saturation, brightness, durationMs, transitionMs)
+            shared = shared_scene(tuple(tuple(item) for item in end_scene))
+            self.scene = shared.copy()
             self.update_scene_data(
                 self.scene, scene_name=end_scene_name, scene_id=end_scene_id)
-            return self.set_strip_data(self.data)
\ No newline at end of file
+            return self.set_strip_data(payload=scene_payload(
+                self.type, shared, end_scene_name, end_scene_id, 100))
+
+    async def async_update_color(self, on, hue, saturation, brightness) -> bool:
+        """Async version of update_color."""
+        return await run_async(self.update_color, on, hue, saturation, brightness)
+
+    async def async_transition_start(self,
+                                     colors: list,
+                                     name='transition-scene',
+                                     scene_id='transition-scene-id'):
+        """Async version of transition_start."""
+        return await run_async(self.transition_start, colors, name, scene_id)
+
+    async def async_transition_end(self,
+                                   end_scene: list,
+                                   end_scene_name='end-scene',
+                                   end_scene_id='end-scene-id') -> bool:
+        """Async version of transition_end."""
+        return await run_async(
+            self.transition_end, end_scene, end_scene_name, end_scene_id)
@@ -0,0 +1,175 @@
+"""
+Opt-in metrics for requests, discovery and scheduling
+
+Nothing is recorded until enable() is called, every recording site checks
+the module level ENABLED flag first, so a disabled build pays for one
+attribute lookup per request.
+
+Recorded once enabled:
+    elgato_request_seconds          histogram per light, method and endpoint
+    elgato_requests_total           counter per light, method, endpoint and status
+    elgato_request_errors_total     counter per light, endpoint and error type
+    elgato_request_retries_total    counter per light and endpoint
+    elgato_request_bytes_total      counter of bytes sent per light and endpoint
+    elgato_circuit_rejected_total   counter of requests skipped by an open breaker
+    elgato_discovery_seconds        histogram per discovery method
+    elgato_discovered_lights_total  counter per discovery method
+    elgato_schedule_lag_seconds     histogram of how late scheduled calls started
+
+Export with snapshot() (a dictionary) or to_prometheus() (text format).
+"""
+import bisect
+import threading
+
+ENABLED = False
+
+# upper bounds in seconds, requests to a light on the LAN are usually a few ms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = dict()
+_histograms = dict()
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets."""
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Init an empty histogram, the last bucket is +Inf."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        """Return (upper bound, values at or below it) for every bucket, ending with +Inf."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q quantile (0-1) by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower = 0.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        # in the +Inf bucket, the largest finite bound is the best guess
+        return self.buckets[-1]
+
+
+def enable():
+    """Start recording."""
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stop recording, what was recorded so far is kept."""
+    global ENABLED
+    ENABLED = False
+
+
+def _key(name, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value: float, **labels):
+    """Record a value in a histogram."""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def reset():
+    """Forget everything recorded."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot() -> dict:
+    """
+    Return everything recorded as plain data.
+
+    {'counters': {name: [{'labels': {...}, 'value': n}, ...]},
+     'histograms': {name: [{'labels': {...}, 'count': n, 'sum': s,
+                            'p50': s, 'p95': s, 'p99': s,
+                            'buckets': [(upper bound, cumulative count), ...]}, ...]}}
+    """
+    counters = dict()
+    histograms = dict()
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+            histograms.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+                'buckets': histogram.cumulative()})
+    return {'counters': counters, 'histograms': histograms}
+
+
+def _escape(value) -> str:
+    """Escape a label value for the text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: dict, **extra) -> str:
+    """Format labels the way Prometheus expects them."""
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def to_prometheus() -> str:
+    """Return everything recorded in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name, samples in data['counters'].items():
+        lines.append(f'# TYPE {name} counter')
+        for sample in samples:
+            lines.append(f"{name}{_labels(sample['labels'])} {sample['value']}")
+    for name, samples in data['histograms'].items():
+        lines.append(f'# TYPE {name} histogram')
+        for sample in samples:
+            for bound, count in sample['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_labels(sample['labels'], le=le)} {count}")
+            lines.append(f"{name}_sum{_labels(sample['labels'])} {sample['sum']}")
+            lines.append(f"{name}_count{_labels(sample['labels'])} {sample['count']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,129 @@
+"""
+Pre-serialized request bodies
+
+Replaying the same color or scene across a room used to serialize the
+same document once per light per call. Bodies are compiled once into an
+immutable Payload and kept in a small LRU cache, so identical commands
+are only turned into JSON the first time.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+PAYLOAD_CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class Payload(bytes):
+    """JSON body ready to PUT, immutable like bytes."""
+    __slots__ = ()
+
+
+def freeze(document):
+    """
+    Turn a JSON document into a hashable key.
+
+    Scalars are keyed with their type, True, 1 and 1.0 are equal in Python
+    but serialize to different JSON
+    """
+    if isinstance(document, dict):
+        return ('dict',) + tuple((key, freeze(value)) for key, value in document.items())
+    if isinstance(document, list):
+        return ('list',) + tuple(freeze(value) for value in document)
+    return (type(document), document)
+
+
+def _cached(key, build) -> Payload:
+    """Return the payload for key, building and caching it if needed."""
+    with _lock:
+        payload = _cache.get(key)
+        if payload is not None:
+            _cache.move_to_end(key)
+            return payload
+    payload = Payload(json.dumps(build()).encode())
+    with _lock:
+        _cache[key] = payload
+        if len(_cache) > PAYLOAD_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return payload
+
+
+def compile_payload(document: dict) -> Payload:
+    """Compile any JSON document, cached by its content."""
+    return _cached(('document', freeze(document)), lambda: document)
+
+
+def color_document(on, hue, saturation, brightness) -> dict:
+    """Return the /elgato/lights document for a static color."""
+    return {
+        'numberOfLights': 1,
+        'lights': [
+            {'on': on,
+             'hue': hue,
+             'saturation': saturation,
+             'brightness': brightness}
+        ]
+    }
+
+
+def temperature_document(on, brightness, temperature) -> dict:
+    """Return the /elgato/lights document for a white light, temperature is in mireds."""
+    return {
+        'numberOfLights': 1,
+        'lights': [
+            {'on': on,
+             'brightness': brightness,
+             'temperature': temperature}
+        ]
+    }
+
+
+def scene_document(scene, name, scene_id, brightness=100.0) -> dict:
+    """Return the /elgato/lights document for a scene."""
+    return {
+        'numberOfLights': 1,
+        'lights': [
+            {'on': 1,
+             'id': scene_id,
+             'name': name,
+             'brightness': brightness,
+             'numberOfSceneElements': len(scene.data),
+             'scene': scene.data
+             }
+        ]
+    }
+
+
+def color_payload(model, on, hue, saturation, brightness) -> Payload:
+    """
+    Compiled color_document, model is the productName of the light.
+
+    Values are keyed with their type like in freeze
+    """
+    return _cached(
+        ('color', model, type(on), on, type(hue), hue, type(saturation), saturation,
+         type(brightness), brightness),
+        lambda: color_document(on, hue, saturation, brightness))
+
+
+def scene_payload(model, scene, name, scene_id, brightness=100.0) -> Payload:
+    """Compiled scene_document, keyed by the frames of the scene rather than its identity."""
+    return _cached(
+        ('scene', model, scene.key(), name, scene_id, type(brightness), brightness),
+        lambda: scene_document(scene, name, scene_id, brightness))
+
+
+def temperature_payload(model, on, brightness, temperature) -> Payload:
+    """Compiled temperature_document, model is the productName of the light."""
+    return _cached(
+        ('temperature', model, type(on), on, type(brightness), brightness,
+         type(temperature), temperature),
+        lambda: temperature_document(on, brightness, temperature))
+
+
+def clear_cache():
+    """Forget every compiled payload."""
+    with _lock:
+        _cache.clear()
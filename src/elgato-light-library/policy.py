@@ -0,0 +1,234 @@
+"""
+Timeouts, retries and circuit breaking for requests to lights
+
+Every request to a light goes through a RequestPolicy, so a light that
+hangs costs at most its timeout instead of blocking forever. Requests
+that fail to connect, time out or get a 5xx answer are retried with a
+jittered exponential backoff (every request the library makes is
+idempotent, a PUT sets absolute values).
+
+Each light also has a CircuitBreaker. After a few failed requests in a
+row the breaker opens and further requests fail straight away with
+CircuitOpenError, so a dead light does not hold up the rest of a room.
+While it is open the light is probed in the background and the breaker
+closes again as soon as the light answers.
+"""
+import logging
+import random
+import threading
+from time import monotonic, perf_counter, sleep
+from urllib.parse import urlsplit
+import metrics
+from connection import get_session
+from scheduler import get_scheduler
+
+# (connect, read) timeout in seconds for a single attempt
+DEFAULT_TIMEOUT = (1.5, 3.0)
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a light whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop talking to a light after repeated failures until it answers again."""
+
+    def __init__(self,
+                 probe=None,
+                 failure_threshold: int = 3,
+                 reset_timeout: float = 5.0,
+                 max_reset_timeout: float = 60.0,
+                 name=''):
+        """
+        Init a closed breaker.
+
+        probe is called without arguments on a background thread while the
+        breaker is open, it should return True if the light is reachable.
+        The first probe runs reset_timeout seconds after the breaker opened,
+        every failed probe doubles the wait up to max_reset_timeout.
+        Without a probe, a request is let through as a trial once the wait is over
+        """
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self._wait = reset_timeout
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        """Return True if a request may be sent."""
+        return self.state == CLOSED or monotonic() >= self._retry_at
+
+    def record_success(self):
+        """The light answered, close the breaker."""
+        with self._lock:
+            self.failures = 0
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+            self._wait = self.reset_timeout
+        logging.getLogger(__name__).info(f"{self.name} is answering again, closing its circuit")
+        get_scheduler().cancel(('probe', id(self)))
+
+    def record_failure(self):
+        """A request failed, open the breaker once failure_threshold is reached."""
+        log = logging.getLogger(__name__)
+        with self._lock:
+            self.failures += 1
+            now = monotonic()
+            if self.state == CLOSED:
+                if self.failures < self.failure_threshold:
+                    return
+                self.state = OPEN
+                log.warning(f"{self.name} failed {self.failures} times in a row, "
+                            f"skipping it for {self._wait}s")
+            elif now >= self._retry_at:
+                # the trial after the wait failed as well, back off further
+                self._wait = min(self.max_reset_timeout, self._wait * 2)
+            else:
+                # a request that started before the breaker opened
+                return
+            self._retry_at = now + self._wait
+            wait = self._wait
+        if self.probe is not None:
+            get_scheduler().call_later(wait, self._probe, key=('probe', id(self)))
+
+    def reset(self):
+        """Forget every failure, e.g. after the light moved to a new address."""
+        self.record_success()
+
+    def _probe(self):
+        """Check if the light is back."""
+        log = logging.getLogger(__name__)
+        try:
+            reachable = self.probe()
+        except Exception as e:
+            log.debug(f"Probing {self.name} failed: {e}")
+            reachable = False
+        if reachable:
+            self.record_success()
+        else:
+            self.record_failure()
+
+
+class RequestPolicy:
+    """How long to wait on a light and how often to retry."""
+
+    def __init__(self,
+                 timeout=DEFAULT_TIMEOUT,
+                 retries: int = 2,
+                 backoff: float = 0.05,
+                 max_backoff: float = 1.0,
+                 jitter: float = 0.5):
+        """
+        Init the policy.
+
+        timeout is seconds, or a (connect, read) tuple, per attempt
+        retries is how many more attempts a failed request gets
+        the wait before retry n is backoff * 2 ** n (at most max_backoff),
+        randomly shortened by up to jitter of it so lights that failed
+        together do not retry together
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retrying after attempt (counting from 0)."""
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def request(self, method, url, breaker: CircuitBreaker = None, timeout=None, retry=True,
+                latency=None, **kwargs):
+        """
+        Send a request on the shared session following this policy.
+
+        timeout overrides the policy's timeout, retry=False sends it only once.
+        The round trip of every answered attempt is recorded in latency
+        (a LatencyEstimator) if given.
+        Raises CircuitOpenError if breaker is open, otherwise returns the
+        response or raises the error of the last attempt
+        """
+        import requests
+        log = logging.getLogger(__name__)
+        # read once so enabling metrics halfway through a request is harmless
+        record = metrics.ENABLED
+        if record:
+            # labels are only worked out when someone is looking
+            parts = urlsplit(url)
+            light = parts.netloc
+            endpoint = parts.path
+        if breaker is not None and not breaker.allow():
+            if record:
+                metrics.inc('elgato_circuit_rejected_total', light=light, endpoint=endpoint)
+            raise CircuitOpenError(f"{breaker.name} is not answering, not sending {method} {url}")
+        timeout = self.timeout if timeout is None else timeout
+        attempts = 1 + (self.retries if retry else 0)
+        session = get_session()
+        response = None
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                if record:
+                    metrics.inc('elgato_request_retries_total', light=light, endpoint=endpoint)
+                sleep(self.delay(attempt - 1))
+            if record:
+                body = kwargs.get('data')
+                if body:
+                    metrics.inc('elgato_request_bytes_total', len(body), light=light, endpoint=endpoint)
+            started = perf_counter()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                log.debug(f"{method} {url} failed (attempt {attempt + 1} of {attempts}): {e}")
+                if record:
+                    metrics.inc('elgato_request_errors_total',
+                                light=light, endpoint=endpoint, error=type(e).__name__)
+                response = None
+                error = e
+                continue
+            elapsed = perf_counter() - started
+            if latency is not None:
+                latency.record(elapsed)
+            if record:
+                metrics.observe('elgato_request_seconds', elapsed,
+                                light=light, method=method, endpoint=endpoint)
+                metrics.inc('elgato_requests_total',
+                            light=light, method=method, endpoint=endpoint, status=response.status_code)
+            if response.status_code < 500:
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+            log.debug(f"{method} {url} answered {response.status_code} (attempt {attempt + 1} of {attempts})")
+        if breaker is not None:
+            breaker.record_failure()
+        if response is not None:
+            return response
+        raise error
+
+
+_policy = RequestPolicy()
+
+
+def get_policy() -> RequestPolicy:
+    """Return the policy used by lights that do not have their own."""
+    return _policy
+
+
+def set_policy(policy: RequestPolicy):
+    """Replace the policy used by lights that do not have their own."""
+    global _policy
+    _policy = policy
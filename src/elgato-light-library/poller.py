@@ -0,0 +1,149 @@
+"""
+Background polling of light state
+
+A StatePoller refreshes /elgato/lights for every light in a room on a
+fixed interval, all lights at once, and keeps the result in memory.
+Readers such as get_strip_color(max_age=...) use that snapshot instead
+of asking the light again, and callbacks only fire when a light's state
+actually changed. Lights that stop answering are polled less and less
+often until they come back.
+"""
+import logging
+import threading
+from time import monotonic
+from connection import get_executor
+
+# how long a single poll may wait on a light
+POLL_TIMEOUT = 2
+
+
+class StatePoller:
+    """Keep a snapshot of every light's state in a room up to date."""
+
+    def __init__(self, room, interval: float = 2.0, max_interval: float = 60.0,
+                 timeout: float = POLL_TIMEOUT):
+        """
+        Init the poller, call start to begin polling.
+
+        interval is how often healthy lights are polled, a light that fails
+        is polled after twice as long each time, up to max_interval
+        """
+        self.room = room
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # light -> last state it reported
+        self._snapshot = dict()
+        self._failures = dict()
+        self._next_poll = dict()
+        # lights with a poll still waiting on an answer
+        self._polling = set()
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_callback(self, callback):
+        """
+        Call callback(light, old_state, new_state) whenever a light's state changes.
+
+        old_state is None the first time a light is seen.
+        Callbacks run on the poller's worker threads
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """Stop calling callback."""
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def get(self, light):
+        """Return the last state the light reported, or None if it was never polled."""
+        with self._lock:
+            return self._snapshot.get(light)
+
+    def snapshot(self) -> dict:
+        """Return a copy of the light -> state mapping."""
+        with self._lock:
+            return dict(self._snapshot)
+
+    def _poll_light(self, light):
+        """Poll one light, notifying callbacks if it changed."""
+        log = logging.getLogger(__name__)
+        try:
+            # the next poll is the retry, do not hold this one up
+            state = light.fetch_strip_data(timeout=self.timeout, retry=False)
+        except Exception as e:
+            with self._lock:
+                self._polling.discard(light)
+                failures = self._failures.get(light, 0) + 1
+                self._failures[light] = failures
+                backoff = min(self.max_interval, self.interval * 2 ** failures)
+                self._next_poll[light] = monotonic() + backoff
+            log.info(f"Polling {light.full_addr} failed ({failures} in a row), next try in {backoff}s: {e}")
+            return
+        with self._lock:
+            self._polling.discard(light)
+            self._failures.pop(light, None)
+            self._next_poll[light] = monotonic() + self.interval
+            old = self._snapshot.get(light)
+            self._snapshot[light] = state
+            callbacks = list(self._callbacks) if state != old else []
+        for callback in callbacks:
+            try:
+                callback(light, old, state)
+            except Exception as e:
+                log.warning(f"State change callback failed for {light.full_addr}: {e}")
+
+    def poll_once(self, wait=True) -> list:
+        """
+        Poll every light that is due, all at once.
+
+        Lights still busy with an earlier poll are skipped, so one slow light
+        never holds up the others. wait=False returns without waiting for
+        the answers
+        Returns the lights that were polled
+        """
+        now = monotonic()
+        lights = self.room.all_lights()
+        with self._lock:
+            due = [light for light in lights
+                   if light not in self._polling and self._next_poll.get(light, 0) <= now]
+            self._polling.update(due)
+            # forget lights that left the room
+            present = set(lights)
+            for light in list(self._snapshot):
+                if light not in present:
+                    del self._snapshot[light]
+                    self._failures.pop(light, None)
+                    self._next_poll.pop(light, None)
+        executor = get_executor()
+        futures = [executor.submit(self._poll_light, light) for light in due]
+        if wait:
+            for future in futures:
+                future.result()
+        return due
+
+    def _run(self):
+        """Poll until stopped."""
+        while not self._stop.is_set():
+            started = monotonic()
+            self.poll_once(wait=False)
+            self._stop.wait(max(0.0, self.interval - (monotonic() - started)))
+
+    def start(self):
+        """Start polling on a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='elgato-poller', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop polling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,103 @@
+"""
+Thread-safe registry of discovered lights
+
+Lights are keyed by serial number, so a light that is announced again or
+shows up on a new IP address keeps its Light object instead of being
+probed and rebuilt. Every change bumps a version number, and snapshot()
+returns an immutable view that is only rebuilt after a change, so
+readers can iterate freely while discovery runs on other threads.
+"""
+import threading
+from collections import namedtuple
+
+Snapshot = namedtuple('Snapshot', ['version', 'lights'])
+
+# what admit did with a light
+ADDED = 'added'
+MOVED = 'moved'
+KNOWN = 'known'
+
+
+def light_key(light):
+    """Serial number of a light, or its address if it did not report one."""
+    return light.info.get('serialNumber') or light.full_addr
+
+
+class LightRegistry:
+    """Lights keyed by serial number with versioned snapshots."""
+
+    def __init__(self):
+        """Init an empty registry."""
+        self._lock = threading.RLock()
+        self._lights = dict()
+        self.version = 0
+        self._snapshot = Snapshot(0, ())
+
+    def admit(self, light) -> tuple:
+        """
+        Add a freshly probed light.
+
+        If a light with the same serial number is already registered the
+        existing object is kept (and moved if the address changed).
+        Returns (the registered light, ADDED/MOVED/KNOWN)
+        """
+        key = light_key(light)
+        with self._lock:
+            existing = self._lights.get(key)
+            if existing is None:
+                self._lights[key] = light
+                self.version += 1
+                return (light, ADDED)
+            if (existing.addr, existing.port) != (light.addr, light.port):
+                existing.move(light.addr, light.port)
+                self.version += 1
+                return (existing, MOVED)
+            return (existing, KNOWN)
+
+    def move(self, light, addr, port) -> bool:
+        """Point a registered light at a new address, returns False if nothing changed."""
+        with self._lock:
+            if (light.addr, light.port) == (addr, port):
+                return False
+            light.move(addr, port)
+            self.version += 1
+            return True
+
+    def remove(self, light) -> bool:
+        """Remove a light, returns False if it was not registered."""
+        key = light_key(light)
+        with self._lock:
+            if self._lights.get(key) is not light:
+                return False
+            del self._lights[key]
+            self.version += 1
+            return True
+
+    def get(self, serial):
+        """Return the light with this serial number, or None."""
+        with self._lock:
+            return self._lights.get(serial)
+
+    def snapshot(self) -> Snapshot:
+        """
+        Return the current lights as an immutable, versioned tuple.
+
+        Cheap to call repeatedly, the tuple is only rebuilt after a change
+        """
+        with self._lock:
+            if self._snapshot.version != self.version:
+                self._snapshot = Snapshot(self.version, tuple(self._lights.values()))
+            return self._snapshot
+
+    def grouped(self) -> dict:
+        """Return the lights in a new dictionary split by productName."""
+        lights = dict()
+        for light in self.snapshot().lights:
+            lights.setdefault(light.info['productName'], []).append(light)
+        return lights
+
+    def __len__(self):
+        return len(self.snapshot().lights)
+
+    def __contains__(self, light):
+        return light in self.snapshot().lights
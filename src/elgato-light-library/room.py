@@ -1,13 +1,134 @@
 """
 Tasks:
 [TODO] write a docstring
-[TODO] transition to multicast instead of sending instructions to each light individually
 [TODO] general clean this up
-[TODO] handle dictionary that contains multiple light types instead of single list of LightStrips
 """
-from _core import find_light_strips_zeroconf, start_rolling_admission_zeroconf
+from _core import (add_light, find_light_strips_zeroconf, probe_light,
+                   resolve_service_zeroconf, start_rolling_admission_zeroconf,
+                   ServiceListener, PROBE_TIMEOUT)
+from lightindex import LightIndex
+from lights.light import COLOR, SCENES
+from cache import load_cache, save_cache, lights_from_cache, revalidate_lights
+from connection import get_executor, run_async
+from scheduler import get_scheduler, failed_call
+from latency import dispatch_times
+from stream import ColorStream
+from poller import StatePoller
+from scene import Scene
+from payload import color_document, compile_payload, scene_document
+from collections import namedtuple
+from concurrent.futures import wait as wait_for_futures
+from time import monotonic, perf_counter
 import logging
-from time import time
+import threading
+
+# outcome of a command for one light, latency is in seconds (None if it never finished)
+LightResult = namedtuple('LightResult', ['success', 'latency', 'error'])
+# outcome of a command sent to a group, spread is the seconds between the first and last acknowledgement
+GroupResult = namedtuple('GroupResult', ['results', 'spread'])
+
+
+def state_document(state, scene_name='room-scene', scene_id='room-scene-id') -> dict:
+    """Return the /elgato/lights document for a color tuple or a Scene."""
+    if isinstance(state, Scene):
+        return scene_document(state, scene_name, scene_id)
+    on, hue, saturation, brightness = state
+    return color_document(on, hue, saturation, brightness)
+
+
+def supports_state(light, state) -> bool:
+    """Check if a light can show a state, a Scene needs SCENES and a color tuple COLOR."""
+    return light.supports(SCENES if isinstance(state, Scene) else COLOR)
+
+
+def _own_copy(document: dict) -> dict:
+    """Copy a shared document, the scene frames stay shared."""
+    return {
+        'numberOfLights': document['numberOfLights'],
+        'lights': [dict(entry) for entry in document['lights']]}
+
+
+def send_shared(light, document: dict, payload) -> bool:
+    """
+    Send a document that the whole group shares to one light.
+
+    Each light gets its own copy of the document (the scene frames are shared)
+    so editing one light's data later does not leak into the others
+    """
+    return light.set_strip_data(_own_copy(document), payload=payload)
+
+
+def _send_acked(light, document: dict, payload, acked: dict) -> bool:
+    """send_shared, records when the light answered in acked if a request actually went out."""
+    success, sent = light.send_strip_data(_own_copy(document), payload=payload)
+    if sent:
+        acked[light] = perf_counter()
+    return success
+
+
+def can_show(light, state) -> bool:
+    """
+    Check if a light can show a state at all.
+
+    Any light can show a color (see apply_state), a Scene needs SCENES
+    """
+    return light.supports(SCENES) if isinstance(state, Scene) else True
+
+
+def apply_state(light, state, scene_name='room-scene', scene_id='room-scene-id') -> bool:
+    """
+    Apply a state to a single light.
+
+    state is either a color tuple (on, hue, saturation, brightness) or a Scene,
+    lights without COLOR get the color through their own update_color.
+    Raises ValueError for a Scene on a light that cannot run scenes, see can_show
+    """
+    if isinstance(state, Scene):
+        if not light.supports(SCENES):
+            raise ValueError(f"{light.type} at {light.full_addr} cannot run scenes")
+        light.make_scene(scene_name, scene_id)
+        light.update_scene_data(state, scene_name=scene_name, scene_id=scene_id)
+        return light.set_strip_data()
+    on, hue, saturation, brightness = state
+    return light.update_color(on, hue, saturation, brightness)
+
+
+def _timed(func, *args) -> LightResult:
+    """Run func and record whether it worked and how long it took."""
+    start = perf_counter()
+    try:
+        success = bool(func(*args))
+        return LightResult(success, perf_counter() - start, None)
+    except Exception as e:
+        return LightResult(False, perf_counter() - start, e)
+
+
+def _collect(futures: dict, deadline: float) -> dict:
+    """Return light -> LightResult for futures of _timed, lights still running timed out."""
+    results = dict()
+    for light, future in futures.items():
+        if future.done():
+            results[light] = future.result()
+        else:
+            results[light] = LightResult(
+                False, None, TimeoutError(f"{light.full_addr} did not answer within {deadline}s"))
+    return results
+
+
+def _send_landed(light, document: dict, payload, q=None) -> tuple:
+    """
+    send_shared, returns the LightResult and about when the light applied it.
+
+    The time is a time.monotonic() time, None if the light already had the document
+    """
+    acked = dict()
+    result = _timed(_send_acked, light, document, payload, acked)
+    if light not in acked:
+        return (result, None)
+    # the answer takes about as long to come back as the command took to get there
+    return (result, monotonic() - light.latency.one_way(q))
+
+
 class Room:
     """
     Collection of lights that are on the same network.
@@ -18,32 +139,479 @@ class Room:
     def __init__(self, lights: list = []):
         """Init the room."""
         assert type(lights) is list, f"TypeError: {lights} is type: {type(lights)} not type: list"
-        self.lights = lights
+        # lookups by address, serial, name, product and tags, see select
+        self.index = LightIndex()
+        # copy so add_light never edits the caller's list (or the shared default)
+        self.lights = list(lights)
+        self.browser = None
+        # remembered by setup so a single light can be looked up again, see recover_lights
+        self.service_type = '_elg._tcp.local.'
+        self._revalidation = None
+        self.poller = None
 
-    def setup(self, service_type='_elg._tcp.local.', timeout=15):
+    def setup(self,
+              service_type='_elg._tcp.local.',
+              timeout=15,
+              expected_count: int = None,
+              expected_serials: list = None,
+              quiet_period: float = None,
+              cache_path: str = None):
         """
         Find all the lights.
         
         To use a rolling admission set timeout=None
+        expected_count, expected_serials and quiet_period let the search return
+        before timeout, see find_light_strips_zeroconf
+
+        When cache_path is set the lights in the cache are used straight away
+        and revalidated in the background, zeroconf is only used to find
+        the cached lights that did not answer (see wait_for_revalidation).
+        Cached lights found at a new address keep their object, they are moved.
+        A revalidation still running from an earlier setup is waited for first.
+        The cache is rewritten after every search.
         """
+        self.service_type = service_type
+        # an earlier revalidation would overwrite self.lights when it finishes
+        self.wait_for_revalidation()
+        if timeout and cache_path:
+            cached = lights_from_cache(load_cache(cache_path))
+            if cached:
+                lights = dict()
+                for light in cached:
+                    add_light(lights, light)
+                self.lights = lights
+                self.browser = None
+                self._revalidation = threading.Thread(
+                    target=self._revalidate,
+                    args=(cached, cache_path, service_type, timeout, quiet_period),
+                    daemon=True)
+                self._revalidation.start()
+                return True
         if timeout:
             self.lights = find_light_strips_zeroconf(
-                service_type, timeout)
+                service_type, timeout, expected_count, expected_serials, quiet_period)
             self.browser = None
+            if cache_path:
+                save_cache(self.all_lights(), cache_path)
         else:
-            l, browser = start_rolling_admission_zeroconf(service_type)
+            # keep the index in step with lights as they come and go
+            listener = ServiceListener()
+            listener.on_add.append(self.index.add)
+            listener.on_update.append(self.index.update)
+            listener.on_remove.append(self.index.remove)
+            l, browser = start_rolling_admission_zeroconf(service_type, listener)
             self.lights = l
             self.browser = browser
         return True if self.lights else False
 
-    def room_color(self, on, hue, saturation, brightness):
-        """Set color for the whole room."""
-        for light in self.lights:
-            light.update_color(on, hue, saturation, brightness)
+    def _revalidate(self, cached, cache_path, service_type, timeout, quiet_period):
+        """Check the cached lights and search for the ones that moved."""
+        # the serial numbers the cache promised, whatever answers at their addresses now
+        serials = {light: light.info.get('serialNumber') for light in cached}
+        valid, stale = revalidate_lights(cached)
+        if stale:
+            Room.log.info(f"{len(stale)} cached lights did not answer, searching for them")
+            missing = [serials[light] for light in stale]
+            found = find_light_strips_zeroconf(
+                service_type, timeout, expected_serials=missing, quiet_period=quiet_period)
+            known = {serials[light] for light in valid}
+            moved = {serials[light]: light for light in stale}
+            for group in found.values():
+                for prospect in group:
+                    serial = prospect.info.get('serialNumber')
+                    if serial in known:
+                        continue
+                    light = moved.pop(serial, None)
+                    if light is None:
+                        valid.append(prospect)
+                    else:
+                        # keep the cached object, callers may already hold it
+                        self._relocate(light, prospect.addr, prospect.port)
+                        valid.append(light)
+        lights = dict()
+        for light in valid:
+            add_light(lights, light)
+        # swap the whole dictionary so nobody iterates a half updated one
+        self.lights = lights
+        save_cache(valid, cache_path)
+
+    def _matches(self, light, addr, port, timeout) -> bool:
+        """Check if the light at addr:port is light (same serial number)."""
+        found = probe_light(addr, port, light.name, timeout)
+        return found is not None and found.info.get('serialNumber') == light.info.get('serialNumber')
+
+    def _relocate(self, light, addr, port):
+        """Point a light at its new address and re-index it."""
+        Room.log.info(f"{light.full_addr} is now at {addr}:{port}")
+        light.move(addr, port)
+        self.index.update(light)
+
+    def _recover_light(self, light, timeout) -> bool:
+        """Re-probe the light where it was, then ask mDNS for its service name."""
+        if self._matches(light, light.addr, light.port, timeout):
+            light.breaker.reset()
+            return True
+        if light.name:
+            for addr, port in resolve_service_zeroconf(light.name, self.service_type, timeout):
+                if self._matches(light, addr, port, timeout):
+                    self._relocate(light, addr, port)
+                    return True
+        return False
+
+    def recover_lights(self, lights: list, timeout: float = PROBE_TIMEOUT,
+                       sweep_timeout: float = 5) -> dict:
+        """
+        Find lights that stopped answering without rescanning the whole room.
+
+        Each light is first re-probed at the address it had (it may only
+        have missed a request), then looked up by its own mDNS service name.
+        Lights still missing after that are searched for with one discovery
+        sweep that stops as soon as their serial numbers show up
+        (sweep_timeout=0 skips it).
+        Recovered lights keep their object, tags and pending calls, they are
+        only moved, every other light in the room is left alone.
+        Returns a dictionary of light -> True if it was found
+        """
+        executor = get_executor()
+        futures = {light: executor.submit(self._recover_light, light, timeout) for light in lights}
+        recovered = {light: future.result() for light, future in futures.items()}
+        missing = {
+            light.info.get('serialNumber'): light
+            for light, found in recovered.items() if not found and light.info.get('serialNumber')}
+        if missing and sweep_timeout:
+            found = find_light_strips_zeroconf(
+                self.service_type, sweep_timeout, expected_serials=list(missing))
+            for group in found.values():
+                for prospect in group:
+                    light = missing.pop(prospect.info.get('serialNumber'), None)
+                    if light is not None:
+                        self._relocate(light, prospect.addr, prospect.port)
+                        recovered[light] = True
+        lost = [light.full_addr for light, found in recovered.items() if not found]
+        if lost:
+            Room.log.warning(f"Could not find {len(lost)} lights again: {lost}")
+        return recovered
+
+    def recover_light(self, light, timeout: float = PROBE_TIMEOUT, sweep_timeout: float = 5) -> bool:
+        """Find a single light that stopped answering, see recover_lights."""
+        return self.recover_lights([light], timeout, sweep_timeout)[light]
+
+    def wait_for_revalidation(self, timeout=None) -> bool:
+        """
+        Wait for a cached setup to finish revalidating.
+
+        Returns True if there is no revalidation left running
+        """
+        if self._revalidation is None:
+            return True
+        self._revalidation.join(timeout)
+        return not self._revalidation.is_alive()
+
+    def start_polling(self, interval: float = 2.0, max_interval: float = 60.0,
+                      callback=None) -> StatePoller:
+        """
+        Keep every light's state fresh in the background.
+
+        callback(light, old_state, new_state) is called when a light changes,
+        readers can then use get_strip_color(max_age=interval) and similar
+        without sending a request
+        """
+        if self.poller is None:
+            self.poller = StatePoller(self, interval, max_interval)
+        if callback is not None:
+            self.poller.add_callback(callback)
+        return self.poller.start()
+
+    def stop_polling(self):
+        """Stop the background poller."""
+        if self.poller is not None:
+            self.poller.stop()
+
+    @property
+    def lights(self):
+        """
+        The lights in the room.
+
+        setup stores lights in a dictionary split by productName,
+        lights passed in directly are a plain list.
+        Assigning lights re-indexes the room, use add_light/remove_light
+        instead of editing the list or dictionary in place
+        """
+        return self._lights
+
+    @lights.setter
+    def lights(self, lights):
+        self._lights = lights
+        if isinstance(lights, dict):
+            self.index.replace(
+                light for group in list(lights.values()) for light in list(group))
+        else:
+            self.index.replace(lights)
+
+    def add_light(self, light, *tags):
+        """Add a light to the room, optionally with user tags."""
+        if isinstance(self._lights, dict):
+            add_light(self._lights, light)
+        else:
+            self._lights.append(light)
+        self.index.add(light)
+        if tags:
+            self.index.tag(light, *tags)
+
+    def remove_light(self, light) -> bool:
+        """Remove a light from the room, returns False if it was not in the room."""
+        groups = self._lights.values() if isinstance(self._lights, dict) else [self._lights]
+        for group in groups:
+            if light in group:
+                group.remove(light)
+        return self.index.remove(light)
+
+    def all_lights(self) -> list:
+        """Return every light in the room as a flat list."""
+        return self.index.lights()
+
+    def select(self, **criteria) -> list:
+        """
+        Return the lights matching every criterion.
+
+        Criteria: addr, full_addr, serial, name (display name), product (productName) or tag
+        e.g. room.select(product='Elgato Light Strip', tag='stage')
+        """
+        return self.index.select(**criteria)
+
+    def capable(self, capability) -> list:
+        """Return the lights that support a capability (COLOR, TEMPERATURE or SCENES)."""
+        return [light for light in self.all_lights() if light.supports(capability)]
+
+    def get_light(self, **criterion):
+        """Return the single light matching a criterion (e.g. serial='...'), or None."""
+        found = self.select(**criterion)
+        return found[0] if found else None
+
+    def tag(self, light, *tags):
+        """Attach user tags to a light, see select."""
+        self.index.tag(light, *tags)
+
+    def untag(self, light, *tags):
+        """Remove user tags from a light."""
+        self.index.untag(light, *tags)
+
+    def room_batch(self,
+                   state=None,
+                   per_light: dict = None,
+                   deadline: float = 5.0,
+                   scene_name='room-scene',
+                   scene_id='room-scene-id') -> dict:
+        """
+        Apply states to the lights in the room concurrently.
+
+        state is applied to every light, per_light maps lights to their own
+        state and takes priority. A state is a color tuple
+        (on, hue, saturation, brightness) or a Scene.
+        Lights that cannot show their state (a Scene on a light without
+        SCENES) are skipped and left out of the results, like room_transition does.
+        Waits at most deadline seconds, lights that have not answered by then
+        are reported as failed with a TimeoutError.
+        Returns a dictionary of light -> LightResult
+        """
+        if state is not None:
+            targets = {light: (per_light or {}).get(light, state) for light in self.all_lights()}
+        else:
+            targets = dict(per_light or {})
+        skipped = [light.full_addr for light, light_state in targets.items()
+                   if not can_show(light, light_state)]
+        if skipped:
+            Room.log.info(f"Skipping {len(skipped)} lights that cannot show their state: {skipped}")
+            targets = {light: light_state for light, light_state in targets.items()
+                       if can_show(light, light_state)}
+        futures = dict()
+        if state is not None and not per_light:
+            capable = [light for light in targets if supports_state(light, state)]
+            if len(capable) == len(targets):
+                # every light gets the same thing, serialize it once for the whole room
+                return self.room_send(
+                    state_document(state, scene_name, scene_id), deadline, capable).results
+            # the lights that can show it share one body, the rest go through their own path
+            # and both groups are started before waiting so they change together
+            futures, _ = self._send_all(state_document(state, scene_name, scene_id), capable)
+            targets = {light: state for light in targets if light not in futures}
+        executor = get_executor()
+        for light, light_state in targets.items():
+            futures[light] = executor.submit(
+                _timed, apply_state, light, light_state, scene_name, scene_id)
+        wait_for_futures(futures.values(), timeout=deadline)
+        results = _collect(futures, deadline)
+        failed = [light.full_addr for light, result in results.items() if not result.success]
+        if failed:
+            Room.log.warning(f"{len(failed)} of {len(results)} lights failed: {failed}")
+        return results
+
+    def _send_all(self, document: dict, lights: list) -> tuple:
+        """
+        Start sending a shared document to lights without waiting.
+
+        Returns (light -> Future of its LightResult,
+                 light -> perf_counter time it answered, only for lights that were sent a PUT)
+        """
+        payload = compile_payload(document)
+        acked = dict()
+        executor = get_executor()
+        futures = dict()
+        for light in lights:
+            futures[light] = executor.submit(_timed, _send_acked, light, document, payload, acked)
+        return (futures, acked)
+
+    def room_send(self, document: dict, deadline: float = 5.0, lights: list = None) -> GroupResult:
+        """
+        Send the same /elgato/lights document to every light (or the lights given).
+
+        The lights have no multicast or group control, so this is the next best
+        thing: the document is serialized once and the PUTs are dispatched in a
+        single tight loop over the pooled keep-alive connections.
+        Lights already showing the document are skipped and left out of the spread.
+        Returns a GroupResult with the per light results and the spread between
+        the first and last light acknowledging the command
+        """
+        lights = self.all_lights() if lights is None else lights
+        futures, acked = self._send_all(document, lights)
+        wait_for_futures(futures.values(), timeout=deadline)
+        results = _collect(futures, deadline)
+        times = [acked[light] for light, result in results.items()
+                 if result.success and light in acked]
+        spread = max(times) - min(times) if times else 0.0
+        failed = [light.full_addr for light, result in results.items() if not result.success]
+        if failed:
+            Room.log.warning(f"{len(failed)} of {len(results)} lights failed: {failed}")
+        Room.log.debug(f"group command acknowledged within {spread * 1000:.1f}ms")
+        return GroupResult(results, spread)
+
+    def room_dispatch(self,
+                      state,
+                      lights: list = None,
+                      land_at: float = None,
+                      q: float = None,
+                      margin: float = 0.0,
+                      deadline: float = 5.0,
+                      scene_name='room-scene',
+                      scene_id='room-scene-id') -> GroupResult:
+        """
+        Send a state to every light that can show it (or the lights given) so it lands everywhere at once.
+
+        Each light's round trip time is estimated from the traffic it already
+        answered (light.latency), slow lights are sent to earlier by half of it.
+        land_at is a time.monotonic() time, by default as soon as the slowest
+        light can make it plus margin. q plans with that quantile of recent
+        round trips instead of their average, e.g. 0.9 on congested Wi-Fi.
+        Waits at most deadline seconds after land_at.
+        Returns a GroupResult, spread is the estimated time between the first
+        and last light applying the state
+        """
+        if lights is None:
+            lights = [light for light in self.all_lights() if supports_state(light, state)]
+        document = state_document(state, scene_name, scene_id)
+        payload = compile_payload(document)
+        send_at = dispatch_times(lights, land_at, q, margin)
+        scheduler = get_scheduler()
+        calls = {
+            light: scheduler.call_at(send_at[light], _send_landed, light, document, payload, q)
+            for light in lights}
+        end = max(send_at.values(), default=monotonic()) + deadline
+        results = dict()
+        landed = []
+        for light, call in calls.items():
+            if not call.wait(max(0.0, end - monotonic())):
+                call.cancel()
+                results[light] = LightResult(
+                    False, None, TimeoutError(f"{light.full_addr} did not answer within {deadline}s"))
+            elif call.error is not None:
+                results[light] = LightResult(False, None, call.error)
+            else:
+                results[light], applied = call.result
+                if results[light].success and applied is not None:
+                    landed.append(applied)
+        spread = max(landed) - min(landed) if landed else 0.0
+        failed = [light.full_addr for light, result in results.items() if not result.success]
+        if failed:
+            Room.log.warning(f"{len(failed)} of {len(results)} lights failed: {failed}")
+        return GroupResult(results, spread)
+
+    def stream(self, fps: float = 25, source=None, lights: list = None) -> ColorStream:
+        """
+        Start streaming live colors to every color light (or the lights given).
+
+        See ColorStream, push colors to it or give a source(light, t)
+        Returns the started stream, stop it when done
+        """
+        lights = self.capable(COLOR) if lights is None else lights
+        return ColorStream(lights, fps, source).start()
+
+    def room_color(self, on, hue, saturation, brightness) -> bool:
+        """
+        Set color for the whole room.
+
+        Every light is updated concurrently on the shared connection pool
+        Returns True if every light accepted the color, see room_batch for per light results
+        """
+        results = self.room_batch((on, hue, saturation, brightness))
+        return all(result.success for result in results.values())
+
+    async def async_room_color(self, on, hue, saturation, brightness) -> bool:
+        """Async version of room_color."""
+        import asyncio
+        results = await asyncio.gather(
+            *(light.async_update_color(on, hue, saturation, brightness)
+              for light in self.all_lights()),
+            return_exceptions=True)
+        return all(result is True for result in results)
+
+    def room_scene(self, scene: Scene, name='room-scene', scene_id='room-scene-id') -> bool:
+        """
+        Set all lights in the room that can run scenes to a specific scene.
+
+        Returns True if every one of them accepted the scene
+        """
+        results = self.room_batch(scene, scene_name=name, scene_id=scene_id)
+        return all(result.success for result in results.values())
+
+    def _schedule_transitions(self,
+                              lights: list,
+                              colors: list,
+                              name,
+                              scene_id,
+                              end_scene: list,
+                              end_scene_name,
+                              end_scene_id) -> list:
+        """
+        Start a transition on every light and schedule its end.
+
+        Starting a new transition on a light replaces its pending end,
+        a light that could not be started gets a call that already failed
+        Returns the ScheduledCall for each light
+        """
+        scheduler = get_scheduler()
+
+        def start(light):
+            # schedule the end as soon as this light started, a slow light
+            # must not push back the end of the others
+            duration = light.transition_start(colors, name, scene_id)
+            return scheduler.call_later(
+                duration, light.transition_end,
+                end_scene, end_scene_name, end_scene_id,
+                key=('transition', light.full_addr))
 
-    def room_scene(self, scene):
-        """Set all lights in the room to a specific scene."""
-        # TODO: write this method
+        # start every light at once instead of one after another
+        executor = get_executor()
+        started = [(light, executor.submit(start, light)) for light in lights]
+        calls = []
+        for light, future in started:
+            # a light that is down fails on its own without holding up the others
+            error = future.exception()
+            if error is not None:
+                Room.log.warning(f"Could not start the transition on {light.full_addr}: {error}")
+                calls.append(failed_call(error, ('transition', light.full_addr)))
+                continue
+            calls.append(future.result())
+        return calls
 
     def room_transition(self,
                         colors: list,
@@ -51,42 +619,77 @@ class Room:
                         scene_id='transition-scene-id',
                         end_scene: list = [],
                         end_scene_name="end-scene",
-                        end_scene_id="end-scene-id"):
+                        end_scene_id="end-scene-id",
+                        wait=True):
         """
-        Non blocking transition for all room lights.
+        Transition for all room lights that can run scenes.
 
-        TODO: return status of https request
+        The end of each light's transition is run by the scheduler at its deadline.
+        With wait=False the ScheduledCall of every light is returned straight
+        away, otherwise this blocks until every transition ended and returns
+        True if all of them succeeded.
+        Lights that failed are looked up again with recover_lights,
+        the lights that worked are left alone
         """
-        rescan = False
         if not colors:
             Room.log.warning("Cannot transition to an empty scene")
             return
 
-        times = []
-        for light in self.lights:
-            times.append((
-                light,
-                light.transition_start(colors, name, scene_id),
-                time()))
-
-        while times:
-            # TODO: check if this can be optimized to use less
-            light, sleep_time, start_time = times.pop(0)
-            # light, transition_start_output, start_time = times.pop(0)
-            # print(transition_start_output)
-            # sleep_time, success = transition_start_output
-            if sleep_time + start_time < time():
-                transition_status = light.transition_end(
-                    end_scene, end_scene_name, end_scene_id)
-                rescan = rescan or not transition_status
-            else:
-                times.append((light, sleep_time, start_time))
-        if rescan and not self.browser:
-            Room.log.info("Rescanning because a light failed - this is only useful when not using rolling admission")
-            self.setup()
-        elif rescan:
+        lights = self.capable(SCENES)
+        calls = self._schedule_transitions(
+            lights, colors, name, scene_id,
+            end_scene, end_scene_name, end_scene_id)
+        if not wait:
+            return calls
+
+        failed = []
+        for light, call in zip(lights, calls):
+            call.wait()
+            # a transition that was replaced by a newer one did not fail
+            if not (call.cancelled or call.result):
+                failed.append(light)
+        if failed and not self.browser:
+            Room.log.info(f"Looking for {len(failed)} lights that failed - rolling admission does this on its own")
+            self.recover_lights(failed)
+        elif failed:
             Room.log.warning("A transition failed but rolling admission is active")
-        return not rescan
+        return not failed
+
+    async def async_room_transition(self,
+                                    colors: list,
+                                    name='transition-scene',
+                                    scene_id='transition-scene-id',
+                                    end_scene: list = [],
+                                    end_scene_name="end-scene",
+                                    end_scene_id="end-scene-id"):
+        """
+        Async version of room_transition.
+
+        Each light sleeps on the event loop until its own transition is done
+        """
+        if not colors:
+            Room.log.warning("Cannot transition to an empty scene")
+            return
+
+        import asyncio
+
+        async def run(light):
+            sleep_time = await light.async_transition_start(colors, name, scene_id)
+            await asyncio.sleep(sleep_time)
+            return await light.async_transition_end(
+                end_scene, end_scene_name, end_scene_id)
+
+        lights = self.capable(SCENES)
+        results = await asyncio.gather(
+            *(run(light) for light in lights),
+            return_exceptions=True)
+        failed = [light for light, result in zip(lights, results) if result is not True]
+        if failed and not self.browser:
+            Room.log.info(f"Looking for {len(failed)} lights that failed - rolling admission does this on its own")
+            await run_async(self.recover_lights, failed)
+        elif failed:
+            Room.log.warning("A transition failed but rolling admission is active")
+        return not failed
 
     def light_transition(self,
                          addr: str,
@@ -95,29 +698,24 @@ class Room:
                          scene_id='transition-scene-id',
                          end_scene: list = [],
                          end_scene_name="end-scene",
-                         end_scene_id="end-scene-id"):
-        """Non blocking transition for specific light in the room."""
-        rescan = False
+                         end_scene_id="end-scene-id",
+                         wait=True):
+        """
+        Transition for specific light in the room.
+
+        Same as room_transition but only for the lights at addr
+        """
         if not colors:
             # print("cannot transition an empty scene")
             return
         if not end_scene:
-            end_scene = colors[-1]
-        times = []
-        for light in self.lights:
-            if light.addr == addr:
-                times.append((
-                    light,
-                    light.transition_start(colors, name, scene_id),
-                    time()))
-
-        while times:
-            light, transition_start_output, start_time = times.pop(0)
-            sleep_time, success = transition_start_output
-            if sleep_time + start_time < time():
-                rescan = rescan or light.transition_end(
-                        end_scene, end_scene_name, end_scene_id)
-            else:
-                times.append((light, sleep_time, start_time))
-
-        return
+            end_scene = colors[-1:]
+        lights = [light for light in self.index.find('addr', addr) if light.supports(SCENES)]
+        calls = self._schedule_transitions(
+            lights, colors, name, scene_id,
+            end_scene, end_scene_name, end_scene_id)
+        if not wait:
+            return calls
+        for call in calls:
+            call.wait()
+        return all(call.cancelled or call.result for call in calls)
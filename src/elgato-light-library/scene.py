@@ -1,11 +1,22 @@
 """
-TODO: write this doc string
+Scenes that can be sent to light strips
+
+A scene is a loop of frames, each frame is a color that is held for
+durationMs and then faded into the next one over transitionMs.
+Frames are stored in parallel typed arrays so thousands of scenes fit in
+memory, and the total duration and frame start times are cached.
 
 Tasks:
 [TODO] clean up project structure
-[TODO] make type checks raise errors instead of using asserts
 [TODO] add documentation
 """
+import functools
+from array import array
+from bisect import bisect_right
+
+FRAME_KEYS = ('hue', 'saturation', 'brightness', 'durationMs', 'transitionMs')
+
+
 class Scene:
     """
     Store and manipulate scenes at a high level.
@@ -23,21 +34,69 @@ class Scene:
         ]
     }
     """
+    __slots__ = ('hue', 'saturation', 'brightness', 'durationMs', 'transitionMs',
+                 '_ends', '_export', '_key')
 
-    def __init__(self, input_scene=[]):
-        """Init the scene."""
+    def __init__(self, input_scene=()):
+        """Init the scene from a list of frames in the device format."""
+        self.hue = array('d')
+        self.saturation = array('d')
+        self.brightness = array('d')
+        self.durationMs = array('l')
+        self.transitionMs = array('l')
+        # end time (ms) of every frame, None when it needs to be rebuilt
+        self._ends = array('q')
+        # frames in the device format, None when it needs to be rebuilt
+        self._export = None
+        # fingerprint of the frames, None when it needs to be rebuilt
+        self._key = None
         for item in input_scene:
-            assert type(item) is dict, f"TypeError: item: {item} is type: {type(item)} not type: dict"
-        self.data = input_scene
+            if type(item) is not dict:
+                raise TypeError(f"item: {item} is type: {type(item)} not type: dict")
+            self.add_scene(*(item[key] for key in FRAME_KEYS))
+
+    def from_arrays(hue, saturation, brightness, durationMs, transitionMs):
+        """
+        Build a scene from parallel sequences of frame values.
+
+        durationMs and transitionMs must hold integers
+        """
+        scene = Scene()
+        scene.hue.extend(hue)
+        scene.saturation.extend(saturation)
+        scene.brightness.extend(brightness)
+        scene.durationMs.extend(durationMs)
+        scene.transitionMs.extend(transitionMs)
+        scene._changed()
+        return scene
+
+    def copy(self) -> 'Scene':
+        """Return a scene with the same frames that can be edited on its own."""
+        scene = Scene.from_arrays(self.hue, self.saturation, self.brightness,
+                                  self.durationMs, self.transitionMs)
+        # the fingerprint is immutable, the copy starts with the same one
+        scene._key = self._key
+        return scene
+
+    def _changed(self):
+        """Forget the cached export and frame times after an edit."""
+        self._export = None
+        self._key = None
+        self._ends = None
 
     def add_scene(self, hue, saturation, brightness, durationMs, transitionMs):
         """Add an item to the end of the list."""
-        self.data.append(
-            {'hue': hue,
-             'saturation': saturation,
-             'brightness': brightness,
-             'durationMs': durationMs,
-             'transitionMs': transitionMs})
+        self.hue.append(hue)
+        self.saturation.append(saturation)
+        self.brightness.append(brightness)
+        self.durationMs.append(int(durationMs))
+        self.transitionMs.append(int(transitionMs))
+        self._export = None
+        self._key = None
+        # appending only needs one more end time, no need to rebuild
+        if self._ends is not None:
+            last = self._ends[-1] if self._ends else 0
+            self._ends.append(last + int(durationMs) + int(transitionMs))
 
     def insert_scene(self,
                      index,
@@ -47,17 +106,75 @@ class Scene:
                      durationMs,
                      transitionMs):
         """Insert a scene in the list."""
-        self.data.insert(
-            index,
-            {'hue': hue,
-             'saturation': saturation,
-             'brightness': brightness,
-             'durationMs': durationMs,
-             'transitionMs': transitionMs})
+        self.hue.insert(index, hue)
+        self.saturation.insert(index, saturation)
+        self.brightness.insert(index, brightness)
+        self.durationMs.insert(index, int(durationMs))
+        self.transitionMs.insert(index, int(transitionMs))
+        self._changed()
 
     def delete_scene(self, index=0):
         """Remove a scene from the list."""
-        return self.data.pop(index)
+        frame = self.frame(index)
+        for values in (self.hue, self.saturation, self.brightness,
+                       self.durationMs, self.transitionMs):
+            values.pop(index)
+        self._changed()
+        return frame
+
+    def frame(self, index) -> dict:
+        """Return a single frame in the device format."""
+        return {
+            'hue': self.hue[index],
+            'saturation': self.saturation[index],
+            'brightness': self.brightness[index],
+            'durationMs': self.durationMs[index],
+            'transitionMs': self.transitionMs[index]}
+
+    @property
+    def data(self) -> list:
+        """
+        Frames in the format the light expects for 'scene'.
+
+        The list is built once and reused until the scene is edited,
+        treat it as read only
+        """
+        if self._export is None:
+            self._export = [
+                {'hue': hue,
+                 'saturation': saturation,
+                 'brightness': brightness,
+                 'durationMs': durationMs,
+                 'transitionMs': transitionMs}
+                for hue, saturation, brightness, durationMs, transitionMs in zip(
+                    self.hue, self.saturation, self.brightness,
+                    self.durationMs, self.transitionMs)]
+        return self._export
+
+    def key(self) -> tuple:
+        """
+        Hashable fingerprint of the frames.
+
+        Two scenes with the same frames have the same key, it is cached
+        until the scene is edited
+        """
+        if self._key is None:
+            self._key = tuple(
+                values.tobytes() for values in (
+                    self.hue, self.saturation, self.brightness,
+                    self.durationMs, self.transitionMs))
+        return self._key
+
+    def _frame_ends(self) -> array:
+        """Return the end time of every frame, rebuilding it if an edit invalidated it."""
+        if self._ends is None:
+            ends = array('q')
+            total = 0
+            for durationMs, transitionMs in zip(self.durationMs, self.transitionMs):
+                total += durationMs + transitionMs
+                ends.append(total)
+            self._ends = ends
+        return self._ends
 
     def print_scenes(self):
         """Display every scene in the loop."""
@@ -66,8 +183,38 @@ class Scene:
 
     def length(self):
         """Return the duration of the scene."""
-        scene_length = 0
-        for scene in self.data['scene']:
-            scene_length += scene['durationMs']
-            scene_length += scene['transitionMs']
-        return scene_length
+        ends = self._frame_ends()
+        return ends[-1] if ends else 0
+
+    def frame_at(self, time_ms) -> int:
+        """
+        Return the index of the frame that is showing time_ms into the scene.
+
+        The scene loops, so times past the end wrap around
+        """
+        total = self.length()
+        if not total:
+            raise ValueError("an empty scene has no frames")
+        return bisect_right(self._frame_ends(), time_ms % total)
+
+    def __len__(self):
+        return len(self.hue)
+
+    def __iter__(self):
+        """Iterate over frames as (hue, saturation, brightness, durationMs, transitionMs)."""
+        return zip(self.hue, self.saturation, self.brightness,
+                   self.durationMs, self.transitionMs)
+
+
+@functools.lru_cache(maxsize=256)
+def shared_scene(frames: tuple) -> Scene:
+    """
+    Return a Scene for a tuple of (hue, saturation, brightness, durationMs, transitionMs).
+
+    The same frames always give back the same Scene object so its export
+    and payloads are reused, it is shared and must not be edited
+    """
+    scene = Scene()
+    for frame in frames:
+        scene.add_scene(*frame)
+    return scene
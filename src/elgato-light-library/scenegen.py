@@ -0,0 +1,167 @@
+"""
+Generate scenes for many lights at once
+
+Colors are numpy arrays of (hue, saturation, brightness) on the last axis,
+usually shaped (lights, frames, 3), so a whole cue of per-light gradients
+is computed in a handful of vector operations instead of Python loops.
+Hue is in degrees (0-360) and always interpolated the short way around
+the color wheel, saturation and brightness are 0-100.
+
+Requires numpy:
+    $ pip install numpy
+"""
+import logging
+from scene import Scene
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _require_numpy():
+    """Fail with a helpful message when numpy is not installed."""
+    if np is None:
+        log = logging.getLogger(__name__)
+        log.warning("please install numpy to use this module")
+        log.warning("$ pip install numpy")
+        raise ImportError("scenegen requires numpy")
+
+
+def _linear(t):
+    return t
+
+
+def _ease_in(t):
+    return t * t
+
+
+def _ease_out(t):
+    return 1 - (1 - t) ** 2
+
+
+def _ease_in_out(t):
+    return t * t * (3 - 2 * t)
+
+
+def _sine(t):
+    return (1 - np.cos(np.pi * t)) / 2
+
+
+# easing curves map progress 0..1 onto progress 0..1
+EASINGS = {
+    'linear': _linear,
+    'ease_in': _ease_in,
+    'ease_out': _ease_out,
+    'ease_in_out': _ease_in_out,
+    'sine': _sine,
+}
+
+
+def interpolate(start, end, t):
+    """
+    Interpolate between colors, taking the short way around the hue circle.
+
+    start and end broadcast against each other with (hue, saturation, brightness)
+    on the last axis, t broadcasts against everything but the last axis
+    """
+    _require_numpy()
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    t = np.asarray(t, dtype=float)[..., np.newaxis]
+    result = start + (end - start) * t
+    # hue wraps, so go through 0/360 when that is shorter
+    hue_delta = (end[..., 0] - start[..., 0] + 180) % 360 - 180
+    result[..., 0] = (start[..., 0] + hue_delta * t[..., 0]) % 360
+    return result
+
+
+def gradient(start, end, frames: int, easing='linear'):
+    """
+    Build a gradient from start to end for every light.
+
+    start and end are (lights, 3) or (3,) colors
+    Returns an array of shape (lights, frames, 3), or (frames, 3) for a single color
+    """
+    _require_numpy()
+    if frames < 1:
+        raise ValueError("a gradient needs at least one frame")
+    curve = EASINGS[easing] if isinstance(easing, str) else easing
+    t = curve(np.linspace(0.0, 1.0, frames))
+    start = np.asarray(start, dtype=float)[..., np.newaxis, :]
+    end = np.asarray(end, dtype=float)[..., np.newaxis, :]
+    return interpolate(start, end, t)
+
+
+def resample(colors, frames: int):
+    """
+    Resample colors of shape (..., n, 3) to (..., frames, 3).
+
+    Used to squeeze long animations into the number of scene elements
+    a light supports, or to stretch short ones
+    """
+    _require_numpy()
+    colors = np.asarray(colors, dtype=float)
+    count = colors.shape[-2]
+    if count == frames:
+        return colors.copy()
+    if count == 1:
+        return np.repeat(colors, frames, axis=-2)
+    position = np.linspace(0.0, count - 1, frames)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, count - 1)
+    return interpolate(
+        colors[..., lower, :], colors[..., upper, :], position - lower)
+
+
+def resample_timing(values, frames: int):
+    """Linearly resample per frame timings of shape (..., n) to (..., frames)."""
+    _require_numpy()
+    values = np.asarray(values, dtype=float)
+    count = values.shape[-1]
+    if count == 1:
+        return np.repeat(values, frames, axis=-1)
+    position = np.linspace(0.0, count - 1, frames)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, count - 1)
+    fraction = position - lower
+    return values[..., lower] * (1 - fraction) + values[..., upper] * fraction
+
+
+def to_scenes(colors, durationMs, transitionMs, max_elements: int = None) -> list:
+    """
+    Turn colors of shape (lights, frames, 3) into one Scene per light.
+
+    durationMs and transitionMs are scalars or broadcast to (lights, frames).
+    If max_elements is given, longer animations are resampled down to it
+    and their timing is scaled so the loop keeps the same length
+    """
+    _require_numpy()
+    colors = np.asarray(colors, dtype=float)
+    if colors.ndim == 2:
+        colors = colors[np.newaxis]
+    lights, frames, _ = colors.shape
+    durations = np.broadcast_to(np.asarray(durationMs, dtype=float), (lights, frames))
+    transitions = np.broadcast_to(np.asarray(transitionMs, dtype=float), (lights, frames))
+    if max_elements is not None and frames > max_elements:
+        scale = frames / max_elements
+        colors = resample(colors, max_elements)
+        durations = resample_timing(durations, max_elements) * scale
+        transitions = resample_timing(transitions, max_elements) * scale
+    durations = np.rint(durations).astype(int)
+    transitions = np.rint(transitions).astype(int)
+    return [
+        Scene.from_arrays(
+            colors[light, :, 0].tolist(),
+            colors[light, :, 1].tolist(),
+            colors[light, :, 2].tolist(),
+            durations[light].tolist(),
+            transitions[light].tolist())
+        for light in range(lights)]
+
+
+def gradient_scenes(start, end, frames: int, durationMs, transitionMs,
+                    easing='linear', max_elements: int = None) -> list:
+    """Build a gradient scene for every light, see gradient and to_scenes."""
+    colors = gradient(start, end, frames, easing)
+    return to_scenes(colors, durationMs, transitionMs, max_elements)
@@ -0,0 +1,163 @@
+"""
+Deadline scheduler for timed light commands
+
+Calls are kept in a heap ordered by deadline and a single thread sleeps
+until the next one is due, so thousands of pending transitions cost no
+CPU while they wait. Due calls are handed to the shared worker pool so a
+slow light never delays the lights behind it.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from time import monotonic
+import metrics
+from connection import get_executor
+
+
+class ScheduledCall:
+    """Handle for a call waiting in the scheduler."""
+
+    def __init__(self, deadline, func, args, key=None):
+        """Init the call, deadline is in time.monotonic() seconds."""
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.key = key
+        self.cancelled = False
+        self.started = False
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        # makes cancel and start mutually exclusive
+        self._lock = threading.Lock()
+
+    def cancel(self) -> bool:
+        """
+        Stop the call from running.
+
+        Returns False if it already started
+        """
+        with self._lock:
+            if self.started:
+                return False
+            self.cancelled = True
+        self._done.set()
+        return True
+
+    def done(self) -> bool:
+        """Return True once the call ran or was cancelled."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        """Block until the call ran or was cancelled, returns done()."""
+        return self._done.wait(timeout)
+
+    def _run(self):
+        """Run the call and store what it returned."""
+        log = logging.getLogger(__name__)
+        if metrics.ENABLED:
+            metrics.observe('elgato_schedule_lag_seconds', max(0.0, monotonic() - self.deadline))
+        try:
+            self.result = self.func(*self.args)
+        except Exception as e:
+            log.warning(f"Scheduled call {self.func} failed: {e}")
+            self.error = e
+        finally:
+            self._done.set()
+
+
+class Scheduler:
+    """Run calls at their deadline without busy waiting."""
+
+    def __init__(self):
+        """Init the scheduler, the worker thread starts with the first call."""
+        self._heap = []
+        # breaks ties between equal deadlines so calls never get compared
+        self._counter = itertools.count()
+        # pending call for each key, scheduling a key again replaces it
+        self._keys = dict()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_at(self, deadline, func, *args, key=None) -> ScheduledCall:
+        """
+        Run func(*args) at deadline (time.monotonic() seconds).
+
+        If key is given, a call still pending under the same key is cancelled
+        """
+        call = ScheduledCall(deadline, func, args, key)
+        with self._cond:
+            if key is not None:
+                previous = self._keys.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self._keys[key] = call
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='elgato-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return call
+
+    def call_later(self, delay, func, *args, key=None) -> ScheduledCall:
+        """Run func(*args) in delay seconds."""
+        return self.call_at(monotonic() + delay, func, *args, key=key)
+
+    def cancel(self, key) -> bool:
+        """Cancel the pending call for key, returns False if there was none."""
+        with self._cond:
+            call = self._keys.pop(key, None)
+        return call.cancel() if call is not None else False
+
+    def pending(self) -> int:
+        """Return how many calls are waiting to run."""
+        with self._cond:
+            return sum(1 for _, _, call in self._heap if not call.cancelled)
+
+    def _run(self):
+        """Sleep until the next deadline and dispatch everything that is due."""
+        executor = get_executor()
+        with self._cond:
+            while True:
+                # cancelled calls are dropped lazily when they reach the top
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                _, _, call = heapq.heappop(self._heap)
+                if call.key is not None and self._keys.get(call.key) is call:
+                    del self._keys[call.key]
+                with call._lock:
+                    if call.cancelled:
+                        continue
+                    call.started = True
+                executor.submit(call._run)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Return the process wide scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def failed_call(error, key=None) -> ScheduledCall:
+    """Return a call that already failed with error, for work that could not be scheduled."""
+    call = ScheduledCall(monotonic(), None, (), key)
+    call.started = True
+    call.error = error
+    call._done.set()
+    return call
@@ -0,0 +1,178 @@
+"""
+Stream live colors to lights at a fixed frame rate
+
+For effects that are computed as they play (audio reactive colors, games,
+live controls) uploading a scene is no use. A ColorStream runs a frame
+clock, and on every tick sends each light its latest color through its
+CommandQueue, the same way update_color would set it. Only the fields that
+changed go out, over the pooled keep-alive connection to the light.
+
+A light that has not answered the previous frame yet is not sent a new
+one, the frame is dropped and the light gets whatever is current on the
+next tick, so a slow light falls behind in frames rather than in time.
+"""
+import logging
+import threading
+from time import monotonic
+from payload import color_document
+
+# weight of a new sample in the lag moving average
+LAG_ALPHA = 0.2
+
+
+class _LightStream:
+    """Frame counters of a single light."""
+
+    def __init__(self):
+        self.color = None
+        self.last_sent = None
+        # tick of the frame the light is busy with
+        self.in_flight = None
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.dropped = 0
+        self.lag = None
+        self.max_lag = 0.0
+
+
+class ColorStream:
+    """Send the latest color of every light at a target frame rate."""
+
+    def __init__(self, lights: list, fps: float = 25, source=None):
+        """
+        Init the stream, call start to begin sending.
+
+        source is an optional callable source(light, t) returning the color
+        (on, hue, saturation, brightness) of a light t seconds into the stream,
+        or None to leave it as it is. Colors can also be pushed with push
+        """
+        self.lights = list(lights)
+        self.fps = fps
+        self.source = source
+        self.frames = 0
+        self._streams = {light: _LightStream() for light in self.lights}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._stopped = None
+
+    def push(self, color, lights: list = None):
+        """Set the color to send on the next frame to every light (or the lights given)."""
+        with self._lock:
+            for light in (self.lights if lights is None else lights):
+                self._streams[light].color = color
+
+    def _acked(self, light, tick, future):
+        """Record how a frame went once the light answered."""
+        lag = monotonic() - tick
+        try:
+            success = future.result()
+        except Exception:
+            success = False
+        with self._lock:
+            stream = self._streams[light]
+            stream.in_flight = None
+            if not success:
+                stream.failed += 1
+                # the color never landed, send it again on the next tick
+                stream.last_sent = None
+                return
+            stream.acked += 1
+            stream.lag = lag if stream.lag is None else stream.lag + LAG_ALPHA * (lag - stream.lag)
+            stream.max_lag = max(stream.max_lag, lag)
+
+    def _frame(self, tick):
+        """Send one frame to every light that is ready for it."""
+        log = logging.getLogger(__name__)
+        if self.source is not None:
+            t = tick - self._started
+            for light in self.lights:
+                try:
+                    color = self.source(light, t)
+                except Exception as e:
+                    log.warning(f"Stream source failed for {light.full_addr}: {e}")
+                    continue
+                if color is not None:
+                    self.push(color, [light])
+        sends = []
+        with self._lock:
+            self.frames += 1
+            for light, stream in self._streams.items():
+                if stream.color is None or stream.color == stream.last_sent:
+                    continue
+                if stream.in_flight is not None:
+                    # the light is still busy with an older frame
+                    stream.dropped += 1
+                    continue
+                stream.last_sent = stream.color
+                stream.in_flight = tick
+                stream.sent += 1
+                sends.append((light, stream.color))
+        for light, (on, hue, saturation, brightness) in sends:
+            future = light.queue_strip_data(color_document(on, hue, saturation, brightness))
+            future.add_done_callback(
+                lambda done, light=light: self._acked(light, tick, done))
+
+    def _run(self):
+        """Frame clock, ticks on absolute times so frames do not drift."""
+        interval = 1 / self.fps
+        tick = self._started
+        while not self._stop.is_set():
+            self._frame(tick)
+            tick += interval
+            now = monotonic()
+            if tick < now:
+                # the clock fell behind, skip the frames it missed
+                tick += interval * int((now - tick) / interval + 1)
+            self._stop.wait(tick - now)
+
+    def start(self):
+        """Start streaming on a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._started = monotonic()
+        self._stopped = None
+        self._thread = threading.Thread(
+            target=self._run, name='elgato-stream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop streaming, frames already sent still finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._started is not None and self._stopped is None:
+            self._stopped = monotonic()
+
+    def stats(self) -> dict:
+        """
+        Return how the stream is keeping up.
+
+        fps is the frames per second each light actually acknowledged,
+        lag is the seconds from a frame's tick until the light acknowledged it
+        (moving average and maximum)
+        """
+        elapsed = 0.0
+        if self._started is not None:
+            elapsed = (self._stopped or monotonic()) - self._started
+        with self._lock:
+            lights = {
+                light.full_addr: {
+                    'sent': stream.sent,
+                    'acked': stream.acked,
+                    'failed': stream.failed,
+                    'dropped': stream.dropped,
+                    'fps': stream.acked / elapsed if elapsed else 0.0,
+                    'lag': stream.lag,
+                    'max_lag': stream.max_lag}
+                for light, stream in self._streams.items()}
+            frames = self.frames
+        return {
+            'target_fps': self.fps,
+            'frames': frames,
+            'clock_fps': frames / elapsed if elapsed else 0.0,
+            'lights': lights}
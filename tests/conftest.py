@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the library uses flat imports from its source directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'elgato-light-library'))
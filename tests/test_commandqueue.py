@@ -0,0 +1,75 @@
+import threading
+from commandqueue import CommandQueue, DATA
+
+
+class FakeLight:
+    full_addr = 'fake:9123'
+
+    def __init__(self):
+        self.sent = []
+
+    def set_strip_data(self, document):
+        self.sent.append(document)
+        return True
+
+
+class GapLock:
+    """Lock that can stop a thread right after it releases, to widen race windows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.after_release = None
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+        if self.after_release is not None:
+            self.after_release()
+
+
+def test_submit_while_drain_finishes_is_sent():
+    light = FakeLight()
+    queue = CommandQueue(light)
+    lock = GapLock()
+    queue._lock = lock
+    gap = threading.Event()
+    resume = threading.Event()
+
+    exits = []
+
+    def pause_when_empty():
+        # after sending, the drain takes the lock to count the write and then
+        # to find the queue empty, stop it right after the second one
+        if threading.current_thread() is main or queue.sent != 1:
+            return
+        exits.append(None)
+        if len(exits) == 2:
+            gap.set()
+            resume.wait(2)
+
+    main = threading.current_thread()
+    lock.after_release = pause_when_empty
+    first = queue.submit(DATA, {'on': 1})
+    assert gap.wait(2)
+    second = queue.submit(DATA, {'on': 0})
+    resume.set()
+    assert first.result(timeout=2)
+    assert second.result(timeout=2)
+    assert light.sent == [{'on': 1}, {'on': 0}]
+    assert queue.pending() == 0
+
+
+def test_cancelled_future_does_not_stall_the_queue():
+    light = FakeLight()
+    queue = CommandQueue(light)
+    release = threading.Event()
+    send = light.set_strip_data
+    light.set_strip_data = lambda document: release.wait(2) and send(document)
+    first = queue.submit(DATA, {'on': 1})
+    second = queue.submit(DATA, {'on': 0})
+    assert second.cancel()
+    release.set()
+    assert first.result(timeout=2)
+    assert queue.submit(DATA, {'brightness': 10}).result(timeout=2)